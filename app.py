@@ -5,6 +5,10 @@ from pydantic import BaseModel
 import pyperclip
 import openai
 from dotenv import load_dotenv
+from profiling import install_profiling
+from model_router import route_model
+from run_store import ReplayMiss, get_run_store
+from structured_output import IncrementalJSONParser, openai_response_format, parse_structured, stream_openai
 
 # Load environment variables
 load_dotenv()
@@ -24,6 +28,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in profiling hooks (no-op unless PROFILING_ENABLED is set)
+install_profiling(app)
+
 class ContactInfo(BaseModel):
     name: str | None = None
     email: str | None = None
@@ -46,85 +53,111 @@ class CourseProposal(BaseModel):
     target_audience: str | None = None
     prerequisites: str | None = None
 
-def extract_contact_info(text: str) -> ContactInfo:
+def _run_extraction(form: str, text: str, model: str, schema, messages: list):
+    """
+    Run one extraction as its own run in the run store (see run_store.py),
+    so it can be listed, replayed offline and served from cache.
+    The reply is constrained to `schema` (strict JSON schema), validated by the
+    incremental parser as it streams and repaired locally if it still doesn't validate.
+    """
+    parser = IncrementalJSONParser(schema)
+
+    def request():
+        return stream_openai(
+            openai, parser,
+            model=model,
+            messages=messages,
+            response_format=openai_response_format(schema),
+        )
+
+    store = get_run_store()
+    with store.run(form, kind="app"):
+        _, result = store.call(
+            "extract", form, {"text": text, "schema": schema.__name__}, request,
+            text=lambda response: response.text,
+            parse=lambda raw: parse_structured(raw, schema, parser), model=model,
+        )
+    return result
+
+def extract_contact_info(text: str, model: str | None = None, raise_errors: bool = False) -> ContactInfo:
     """Extract contact information from text using OpenAI's API."""
+    model = model or route_model(text, ContactInfo).model
+
+    messages = [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that extracts contact information from text. "
+                      "Extract name, email, and phone number if present. "
+                      "Return only JSON format with null for missing fields."
+        },
+        {
+            "role": "user",
+            "content": f"Extract contact information from this text: {text}"
+        }
+    ]
+
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that extracts contact information from text. "
-                              "Extract name, email, and phone number if present. "
-                              "Return only JSON format with null for missing fields."
-                },
-                {
-                    "role": "user",
-                    "content": f"Extract contact information from this text: {text}"
-                }
-            ],
-            response_format={ "type": "json_object" }
-        )
-        
-        # Parse the response
-        result = response.choices[0].message.content
-        return ContactInfo.model_validate_json(result)
+        return _run_extraction("contact", text, model, ContactInfo, messages)
+    except ReplayMiss:
+        raise
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error extracting contact info: {e}")
         return ContactInfo()
 
-def extract_job_info(text: str) -> JobInfo:
+def extract_job_info(text: str, model: str | None = None, raise_errors: bool = False) -> JobInfo:
     """Extract job information from text using OpenAI's API."""
+    model = model or route_model(text, JobInfo).model
+
+    messages = [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that extracts job information from text. "
+                      "Extract job title, company name, location, and job description if present. "
+                      "Return only JSON format with null for missing fields."
+        },
+        {
+            "role": "user",
+            "content": f"Extract job information from this text: {text}"
+        }
+    ]
+
     try:
-        response = openai.beta.chat.completions.parse(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that extracts job information from text. "
-                              "Extract job title, company name, location, and job description if present. "
-                              "Return only JSON format with null for missing fields."
-                },
-                {
-                    "role": "user",
-                    "content": f"Extract job information from this text: {text}"
-                }
-            ],
-            response_format=JobInfo
-        )
-        
-        # Parse the response
-        result = response.choices[0].message.parsed
-        return result
+        return _run_extraction("job", text, model, JobInfo, messages)
+    except ReplayMiss:
+        raise
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error extracting job info: {e}")
         return JobInfo()
 
-def extract_course_proposal(text: str) -> CourseProposal:
+def extract_course_proposal(text: str, model: str | None = None, raise_errors: bool = False) -> CourseProposal:
     """Extract course proposal information from text using OpenAI's API."""
+    model = model or route_model(text, CourseProposal).model
+
+    messages = [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that extracts course proposal information from text. "
+                      "Extract course title, target role, course level, required skills, instructor name, "
+                      "instructor entity, course description, target audience, and prerequisites if present. "
+                      "Return only JSON format with null for missing fields."
+        },
+        {
+            "role": "user",
+            "content": f"Extract course proposal information from this text: {text}"
+        }
+    ]
+
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that extracts course proposal information from text. "
-                              "Extract course title, target role, course level, required skills, instructor name, "
-                              "instructor entity, course description, target audience, and prerequisites if present. "
-                              "Return only JSON format with null for missing fields."
-                },
-                {
-                    "role": "user",
-                    "content": f"Extract course proposal information from this text: {text}"
-                }
-            ],
-            response_format={ "type": "json_object" }
-        )
-        
-        # Parse the response
-        result = response.choices[0].message.content
-        return CourseProposal.model_validate_json(result)
+        return _run_extraction("course", text, model, CourseProposal, messages)
+    except ReplayMiss:
+        raise
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error extracting course proposal info: {e}")
         return CourseProposal()
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+Import-time benchmark for copy_structured.py.
+
+Checks two things and exits non-zero if either fails:
+  1) `python copy_structured.py --help` stays under a wall-clock budget
+     (median of several runs, interpreter startup included)
+  2) importing copy_structured does not pull in any heavy dependency
+     (pyautogui, pyperclip, anthropic, openai, google.genai, pydantic, ...)
+
+Usage:
+  python bench_startup.py                 # default budget 0.3s
+  python bench_startup.py --budget 0.2 --runs 20
+  python bench_startup.py --importtime    # also print the slowest imports
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPT = "copy_structured.py"
+MODULE = "copy_structured"
+HEAVY_MODULES = ("pyautogui", "pyperclip", "anthropic", "openai", "google.genai",
+                 "pydantic", "requests", "httpx", "PIL", "asyncio")
+
+
+def time_help(runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT, "--help"], check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def heavy_modules_loaded() -> list:
+    code = (f"import sys, {MODULE}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+def slowest_imports(top: int) -> list:
+    """Parse `python -X importtime` output -> [(cumulative_us, module)], slowest first."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+                            check=True, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Startup-time budget check for {SCRIPT}.")
+    parser.add_argument("--budget", type=float, default=0.3, help="max median seconds for --help")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--importtime", action="store_true", help="print the 10 slowest imports")
+    args = parser.parse_args()
+
+    timings = time_help(args.runs)
+    median = statistics.median(timings)
+    print(f"{SCRIPT} --help: median {median * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms "
+          f"(budget {args.budget * 1000:.0f} ms, {args.runs} runs)")
+
+    heavy = heavy_modules_loaded()
+    print(f"heavy modules loaded at import: {', '.join(heavy) or 'none'}")
+
+    if args.importtime:
+        print("\nslowest imports (cumulative):")
+        for cumulative, name in slowest_imports(10):
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if median > args.budget:
+        print(f"FAIL: startup over budget by {(median - args.budget) * 1000:.0f} ms")
+        failed = True
+    if heavy:
+        print(f"FAIL: import {MODULE} eagerly loads {', '.join(heavy)}")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
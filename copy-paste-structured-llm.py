@@ -156,10 +156,13 @@ contents = [
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 client = genai.Client(api_key=GEMINI_API_KEY)
 
-# Generate content
+# Generate content, constrained to the typed location schema
+from structured_output import LOCATIONS_SCHEMA, gemini_config
+
 response = client.models.generate_content(
     model="gemini-2.0-flash",
-    contents=contents
+    contents=contents,
+    config=gemini_config(LOCATIONS_SCHEMA)
 )
 
 # Print the response
@@ -188,17 +191,12 @@ def parse_form_locations(json_output):
             - points: List of [y, x] coordinates
             - labels: List of corresponding labels
     """
-    import json
-    import re
+    from structured_output import LOCATIONS_SCHEMA, parse_structured
     
-    # If input is a string, try to extract and parse JSON
+    # If input is a string, validate it against the typed location schema
+    # (fences/prose stripped and broken JSON repaired; raises ValueError if unusable)
     if isinstance(json_output, str):
-        # Remove markdown code blocks if present
-        json_str = re.sub(r'```json\n|\n```', '', json_output)
-        try:
-            data = json.loads(json_str)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Failed to parse JSON: {e}")
+        data = [location.model_dump() for location in parse_structured(json_output, LOCATIONS_SCHEMA)]
     else:
         # Assume it's already parsed
         data = json_output
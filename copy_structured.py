@@ -6,6 +6,7 @@ Unified script that:
   2) Calls Gemini to detect on-screen field locations from a screenshot
   3) Uses OpenAI to parse clipboard text into the model
   4) Uses PyAutoGUI to fill the identified fields with extracted data
+     (or bulk-fills html/table.html from a list of records, see section 4b)
 
 Requires the following environment variables or placeholders:
   - ANTHROPIC_API_KEY
@@ -13,35 +14,35 @@ Requires the following environment variables or placeholders:
   - OPENAI_API_KEY
 
 Adjust code as needed (model names, endpoints, file paths, etc.).
+
+Subcommands (run `python copy_structured.py <command> --help` for options):
+  model   screenshot -> Pydantic model code (Claude)
+  locate  screenshot -> field coordinates (Gemini)
+  parse   text or clipboard -> JSON (OpenAI)
+  fill    type extracted data into the fields or a table (PyAutoGUI)
+  run     the whole pipeline, or --batch over many screenshots (default)
+
+Heavy dependencies (pyautogui, pyperclip, anthropic, openai, google.genai,
+pydantic) are imported only inside the functions that use them, and API
+clients are built on first use, so `--help` and the stages that don't need
+a given SDK (or a display) start instantly. bench_startup.py guards this.
 """
 
 import os
+import sys
+import argparse
 import base64
+import glob
+import hashlib
 import re
 import time
-from datetime import datetime
+from dataclasses import dataclass
+from functools import lru_cache
 import json
-import pyautogui
-import pyperclip
-import anthropic
-from openai import OpenAI
-import requests
+from run_store import get_run_store, sha256_text
 
 MODEL_PYDANTIC_OBJECTS = "claude-3-7-sonnet-20250219"
-MODEL_PARSE_TEXT = "gpt-4o"
-# The Google Gemini Python SDK
-try:
-    from google import genai
-except ImportError:
-    print("You must install `google-genai` (and dependencies) for Gemini usage.")
-    raise
-
-# For demonstration, Pydantic 2.x
-try:
-    from pydantic import BaseModel, ValidationError
-except ImportError:
-    print("You must install pydantic>=2.0.")
-    raise
+MODEL_PARSE_TEXT = "gpt-4o"  # fallback; per-request tier comes from model_router
 
 
 # -----------------------------------------------------------------------------
@@ -49,7 +50,12 @@ except ImportError:
 # -----------------------------------------------------------------------------
 
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "YOUR_ANTHROPIC_API_KEY_HERE")
-anthropic_client = anthropic.Client(api_key=ANTHROPIC_API_KEY)
+
+@lru_cache(maxsize=None)
+def get_anthropic_client():
+    """Import the Anthropic SDK and build the client on first use."""
+    import anthropic
+    return anthropic.Client(api_key=ANTHROPIC_API_KEY)
 
 def encode_image_to_base64(image_path: str) -> str:
     """Read image file and base64-encode."""
@@ -67,11 +73,12 @@ def extract_python_code(text: str) -> str:
         return match.group(1).strip()
     return ""
 
-def call_anthropic_for_pydantic(image_path: str) -> str:
+def call_anthropic_for_pydantic(image_path: str, image_b64: str | None = None) -> str:
     """
     Sends a screenshot to Claude (Anthropic) with instructions:
       - "Create the appropriate pydantic object with the attributes for the input forms."
     Returns the raw textual response from Claude, which should have <python> ... </python>.
+    Pass 'image_b64' if the screenshot was already encoded (batch mode).
     """
     print("\n=== [1] Sending screenshot to Anthropic (Claude) to produce Pydantic model ===")
     # The user’s custom prompt
@@ -79,7 +86,7 @@ def call_anthropic_for_pydantic(image_path: str) -> str:
 Create the appropriate pydantic object with the attributes from this input forms page you see in front of you.
 Output your Python code enclosed by XML tags <python> and </python>.
 """
-    image_b64 = encode_image_to_base64(image_path)
+    image_b64 = image_b64 or encode_image_to_base64(image_path)
 
     # Important note: This usage is conceptual. The real Anthropic Chat API
     # might differ in usage/parameters. Adjust to your environment’s requirements.
@@ -87,19 +94,28 @@ Output your Python code enclosed by XML tags <python> and </python>.
     # but the user’s snippet references an older "messages.create" approach.
     # 
     # If your version differs, adapt accordingly.
-    message = anthropic_client.completions.create(
-        model=MODEL_PYDANTIC_OBJECTS,  # or whichever Claude model you have
-        max_tokens_to_sample=1024,
-        prompt=anthropic.HUMAN_PROMPT
-            + f"""{prompt_message}
+    def request():
+        import anthropic
+
+        return get_anthropic_client().completions.create(
+            model=MODEL_PYDANTIC_OBJECTS,  # or whichever Claude model you have
+            max_tokens_to_sample=1024,
+            prompt=anthropic.HUMAN_PROMPT
+                + f"""{prompt_message}
 Here's the form as an image:
 [base64 image]
 {image_b64}
 """
-            + anthropic.AI_PROMPT,
-    )
+                + anthropic.AI_PROMPT,
+        )
 
-    raw_text = message.completion
+    # Recorded in the run store (see run_store.py); replay/cache modes skip the API call
+    raw_text, _ = get_run_store().call(
+        "model", image_path,
+        {"prompt": prompt_message, "image": image_path, "image_sha256": sha256_text(image_b64)},
+        request, text=lambda message: message.completion, parse=extract_python_code,
+        model=MODEL_PYDANTIC_OBJECTS,
+    )
     return raw_text
 
 
@@ -109,11 +125,22 @@ Here's the form as an image:
 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "YOUR_GEMINI_API_KEY_HERE")
 
-def call_gemini_for_locations(image_path: str) -> list:
+@lru_cache(maxsize=None)
+def get_gemini_client():
+    """Import the Google Gemini SDK and build the client on first use."""
+    try:
+        from google import genai
+    except ImportError:
+        print("You must install `google-genai` (and dependencies) for Gemini usage.")
+        raise
+    return genai.Client(api_key=GEMINI_API_KEY)
+
+def call_gemini_for_locations(image_path: str, image_b64: str | None = None) -> list:
     """
     Sends the same screenshot to Gemini, requesting field coordinates in JSON:
       e.g. [{'point': [y, x], 'label': '...'}, ...]
     Returns the result as a Python list of dicts.
+    Pass 'image_b64' if the screenshot was already encoded (batch mode).
     """
     print("\n=== [2] Sending screenshot to Gemini to get form field coordinates ===")
     # Simple prompt
@@ -122,9 +149,8 @@ def call_gemini_for_locations(image_path: str) -> list:
                      "[{'point': [y, x], 'label': '...'}, ...]. "
                      "Points in range 0-1000 for y, x.")
 
-    image_b64 = encode_image_to_base64(image_path)
+    image_b64 = image_b64 or encode_image_to_base64(image_path)
 
-    g_client = genai.Client(api_key=GEMINI_API_KEY)
     contents = [
         {
             "role": "user",
@@ -139,16 +165,35 @@ def call_gemini_for_locations(image_path: str) -> list:
             ]
         }
     ]
-    response = g_client.models.generate_content(model="gemini-2.0", contents=contents)
-    raw_output = response.text.strip()
+    from structured_output import LOCATIONS_SCHEMA, IncrementalJSONParser, gemini_config, stream_gemini
+
+    # Schema-constrained JSON, validated item by item as it streams in
+    parser = IncrementalJSONParser(LOCATIONS_SCHEMA)
+    _, locations = get_run_store().call(
+        "locate", image_path,
+        {"prompt": gemini_prompt, "image": image_path, "image_sha256": sha256_text(image_b64),
+         "schema": "list[FormLocation]"},
+        lambda: stream_gemini(get_gemini_client(), parser, model="gemini-2.0",
+                              contents=contents, config=gemini_config(LOCATIONS_SCHEMA)),
+        text=lambda response: response.text.strip(),
+        parse=lambda raw: parse_gemini_json(raw, LOCATIONS_SCHEMA, parser), model="gemini-2.0",
+    )
+    return locations
+
+
+def parse_gemini_json(raw_output: str, schema=None, parser=None) -> list:
+    """
+    Validate Gemini's answer against the typed schema (default list[FormLocation]),
+    repairing it locally if needed. `parser` is the IncrementalJSONParser the
+    answer was streamed through, so its already-validated items are reused.
+    Returns plain dicts, or [] (and prints the raw output) if nothing usable is left.
+    """
+    from structured_output import LOCATIONS_SCHEMA, StructuredOutputError, dump, parse_structured
 
-    # Try to parse out JSON
     try:
-        # Remove possible code block fences
-        cleaned = re.sub(r"```json\s*|\s*```", "", raw_output)
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        print("Gemini response did not parse as JSON. Raw output below:\n", raw_output)
+        return dump(parse_structured(raw_output, schema or LOCATIONS_SCHEMA, parser))
+    except StructuredOutputError as e:
+        print(f"Gemini response did not match the schema ({e}). Raw output below:\n", raw_output)
         return []
 
 
@@ -157,18 +202,30 @@ def call_gemini_for_locations(image_path: str) -> list:
 # -----------------------------------------------------------------------------
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
-def parse_text_with_openai(raw_text: str, instructions: str) -> str:
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """Import the OpenAI SDK and build the client on first use."""
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY)
+
+def parse_text_with_openai(raw_text: str, instructions: str, model: str = MODEL_PARSE_TEXT,
+                           form: str = "clipboard", schema=None) -> str:
     """
     Example function that calls OpenAI ChatCompletion to parse raw_text
     according to 'instructions' (the system prompt).
     Returns a JSON string.
 
+    'model' defaults to MODEL_PARSE_TEXT; callers usually pass the tier
+    chosen by model_router.route_model. 'form' labels the call in the run store.
+    'schema' is the pydantic model the answer must match; it is sent as a strict
+    JSON schema and the (repaired, validated) result is what gets returned.
+    Without one, the reply is only constrained to be a JSON object.
+
     The user is modeling that they want structured JSON from GPT.
     Adjust model, prompt, etc. as needed.
     """
-    print("\n=== [3] Sending raw text to OpenAI to parse into structured JSON ===")
+    print(f"\n=== [3] Sending raw text to OpenAI ({model}) to parse into structured JSON ===")
 
     messages = [
         {
@@ -181,13 +238,26 @@ def parse_text_with_openai(raw_text: str, instructions: str) -> str:
         }
     ]
 
-    response = openai_client.chat.completions.create(
-        model=MODEL_PARSE_TEXT,
-        messages=messages,
-        temperature=0,
+    from structured_output import AnyObject, IncrementalJSONParser, openai_response_format, parse_structured, stream_openai
+
+    # Validate against the schema (or any JSON object), repairing locally instead of re-asking
+    schema = schema or AnyObject
+    response_format = {"type": "json_object"} if schema is AnyObject else openai_response_format(schema)
+    parser = IncrementalJSONParser(schema)
+
+    _, parsed = get_run_store().call(
+        "parse", form, {"instructions": instructions, "text": raw_text, "schema": schema.__name__},
+        lambda: stream_openai(
+            get_openai_client(), parser,
+            model=model,
+            messages=messages,
+            temperature=0,
+            response_format=response_format,
+        ),
+        text=lambda response: response.text.strip(),
+        parse=lambda content: parse_structured(content, schema, parser), model=model,
     )
-    # The assistant's response presumably is JSON
-    return response.choices[0].message.content.strip()
+    return parsed.model_dump_json()
 
 
 # -----------------------------------------------------------------------------
@@ -203,6 +273,8 @@ def automate_text_input(points: list, text_fields: dict, offset=(0, 0), delay=0.
     offset: if you need to shift the coordinates to match actual screen pos, do so
     e.g., offset=(100, 200).
     """
+    import pyautogui
+
     print("\n=== [4] Filling the form fields with PyAutoGUI ===")
     print("Starting in 3 seconds... Switch to your target window!")
     time.sleep(3)
@@ -228,6 +300,240 @@ def automate_text_input(points: list, text_fields: dict, offset=(0, 0), delay=0.
         time.sleep(delay)
 
 
+# -----------------------------------------------------------------------------
+# 4b) Bulk table fill (html/table.html) from a list of extracted records
+# -----------------------------------------------------------------------------
+#
+# Instead of one Gemini point and one mouse click per cell, we:
+#   - ask Gemini ONCE for the "Rows" size input and the box of the first body cell
+#   - derive the whole grid geometry from that first cell
+#   - build a keyboard plan: resize the table, Tab from the "Resize Table" button
+#     past the header rename buttons to the first cell, then type + Tab through
+#     the row-major `cell-input` fields
+# With pyautogui.PAUSE at 0 a 50x10 table is a few thousand key events.
+
+PASTE_KEY = "command" if sys.platform == "darwin" else "ctrl"
+CELL_CLICK_MARGIN = 20  # px right of a cell's left edge, inside the td padding
+
+
+@dataclass
+class TableGeometry:
+    """Screen geometry of the table grid, derived from the first body cell."""
+    first_cell: tuple        # (x, y) center of row 0 / column 0
+    cell_size: tuple         # (width, height) of one cell
+    rows_input: tuple | None = None  # (x, y) of the "Rows" number input
+    left_edge: float | None = None   # x of the table's left edge (column 0)
+
+    def cell_center(self, row: int, col: int) -> tuple:
+        x, y = self.first_cell
+        width, height = self.cell_size
+        return (round(x + col * width), round(y + row * height))
+
+    def row_anchor(self, row: int) -> tuple:
+        """
+        A point inside column 0 of `row` that stays valid after a resize:
+        `table{width:100%}` re-splits the column widths, so only the left edge
+        of column 0 is stable, not the center measured before the resize.
+        """
+        x, y = self.first_cell
+        width, height = self.cell_size
+        if self.left_edge is not None:
+            x = self.left_edge + min(CELL_CLICK_MARGIN, width / 2)
+        return (round(x), round(y + row * height))
+
+
+def call_gemini_for_table_geometry(image_path: str) -> list:
+    """
+    One Gemini call for the whole table: returns
+      [{'box_2d': [ymin, xmin, ymax, xmax], 'label': 'first_cell'},
+       {'point': [y, x], 'label': 'rows_input'}]
+    """
+    print("\n=== [2b] Sending screenshot to Gemini to get the table geometry ===")
+    gemini_prompt = ("This page has a table of text inputs and a 'Rows' number input above it. "
+                     "Return JSON like: "
+                     "[{'box_2d': [ymin, xmin, ymax, xmax], 'label': 'first_cell'}, "
+                     "{'point': [y, x], 'label': 'rows_input'}], where first_cell is the "
+                     "top-left cell of the table body (below the header row). "
+                     "Coordinates in range 0-1000.")
+
+    image_b64 = encode_image_to_base64(image_path)
+
+    contents = [
+        {
+            "role": "user",
+            "parts": [
+                {"text": gemini_prompt},
+                {
+                    "inlineData": {
+                        "mimeType": "image/png",
+                        "data": image_b64
+                    }
+                }
+            ]
+        }
+    ]
+    from structured_output import TABLE_SCHEMA, IncrementalJSONParser, gemini_config, stream_gemini
+
+    parser = IncrementalJSONParser(TABLE_SCHEMA)
+    _, detection = get_run_store().call(
+        "locate_table", image_path,
+        {"prompt": gemini_prompt, "image": image_path, "image_sha256": sha256_text(image_b64),
+         "schema": "list[TableItem]"},
+        lambda: stream_gemini(get_gemini_client(), parser, model="gemini-2.0",
+                              contents=contents, config=gemini_config(TABLE_SCHEMA)),
+        text=lambda response: response.text.strip(),
+        parse=lambda raw: parse_gemini_json(raw, TABLE_SCHEMA, parser), model="gemini-2.0",
+    )
+    return detection
+
+
+def table_geometry_from_detection(detection: list, offset=(0, 0), scale=(1.0, 1.0)) -> TableGeometry:
+    """
+    Turn the Gemini table detection into screen geometry.
+    scale/offset map Gemini's coordinates to the screen: screen = coord * scale + offset.
+    """
+    by_label = {entry["label"]: entry for entry in detection}
+    if "first_cell" not in by_label:
+        raise ValueError("Gemini detection has no 'first_cell' box")
+
+    if not by_label["first_cell"].get("box_2d"):
+        raise ValueError("Gemini detection has no box for 'first_cell'")
+    ymin, xmin, ymax, xmax = by_label["first_cell"]["box_2d"]
+    width = (xmax - xmin) * scale[0]
+    height = (ymax - ymin) * scale[1]
+    first_cell = ((xmin + xmax) / 2 * scale[0] + offset[0],
+                  (ymin + ymax) / 2 * scale[1] + offset[1])
+
+    rows_input = None
+    if by_label.get("rows_input", {}).get("point"):
+        y, x = by_label["rows_input"]["point"]
+        rows_input = (x * scale[0] + offset[0], y * scale[1] + offset[1])
+
+    return TableGeometry(first_cell=first_cell, cell_size=(width, height), rows_input=rows_input,
+                         left_edge=xmin * scale[0] + offset[0])
+
+
+def records_to_grid(records: list, columns: list | None = None) -> tuple:
+    """
+    Flatten extracted records (dicts or pydantic objects) into (columns, rows of strings).
+    Columns default to the union of keys in first-seen order.
+    """
+    dicts = [r.model_dump() if hasattr(r, "model_dump") else dict(r) for r in records]
+    if columns is None:
+        columns = []
+        for record in dicts:
+            columns.extend(key for key in record if key not in columns)
+    rows = [["" if record.get(col) is None else str(record.get(col)) for col in columns]
+            for record in dicts]
+    return columns, rows
+
+
+def build_table_fill_plan(grid: list, geometry: TableGeometry, resize: bool = True,
+                          anchor_each_row: bool = False, paste_over: int = 20) -> list:
+    """
+    Build the keyboard plan for filling `grid` (a list of rows of strings).
+    Each step is a tuple: ('click', x, y), ('hotkey', *keys), ('press', key),
+    ('write', text), ('paste', text) or ('sleep', seconds).
+
+    Tabbing into an input selects its contents, so typing overwrites old values.
+    Values longer than `paste_over` characters, non-ASCII ones (which
+    pyautogui.write cannot type) and ones containing control characters
+    (a typed tab or newline would move focus or submit) go through the
+    clipboard instead.
+    With resize, the first cell is reached by keyboard: the "Resize Table"
+    button keeps focus after Enter, and the next tab stops are the `n_cols`
+    header rename buttons, then the first `cell-input`. The geometry was
+    measured before the resize, so no click relies on a cell center.
+    anchor_each_row re-clicks column 0 of each row near its left edge
+    (TableGeometry.row_anchor), one click per row; it assumes the row height
+    did not change with the resize.
+    """
+    n_rows = len(grid)
+    n_cols = max((len(row) for row in grid), default=0)
+    plan = []
+
+    if resize:
+        if geometry.rows_input is None:
+            raise ValueError("resize=True needs the 'rows_input' location")
+        # Rows input -> Tab -> Columns input -> Tab -> "Resize Table" button
+        plan += [("click", *geometry.rows_input), ("hotkey", PASTE_KEY, "a"), ("write", str(n_rows)),
+                 ("press", "tab"), ("hotkey", PASTE_KEY, "a"), ("write", str(n_cols)),
+                 ("press", "tab"), ("press", "enter"), ("sleep", 0.3)]
+        # Button -> n_cols rename buttons -> first cell (Tab selects its contents)
+        plan += [("press", "tab")] * (n_cols + 1)
+
+    for r, row in enumerate(grid):
+        if (r == 0 and not resize) or (r > 0 and anchor_each_row):
+            plan += [("click", *geometry.row_anchor(r)), ("hotkey", PASTE_KEY, "a")]
+        for c in range(n_cols):
+            value = row[c] if c < len(row) else ""
+            if len(value) > paste_over or not value.isascii() or not value.isprintable():
+                plan.append(("paste", value))
+            elif value:
+                plan.append(("write", value))
+            else:
+                plan.append(("press", "backspace"))
+            if not (r == n_rows - 1 and c == n_cols - 1):
+                plan.append(("press", "tab"))
+    return plan
+
+
+def execute_table_fill_plan(plan: list):
+    """Run a plan from build_table_fill_plan with no per-action pause."""
+    import pyautogui
+    import pyperclip
+
+    pyautogui.FAILSAFE = True
+    previous_pause, pyautogui.PAUSE = pyautogui.PAUSE, 0
+    try:
+        for action, *args in plan:
+            if action == "click":
+                pyautogui.click(*args)
+            elif action == "hotkey":
+                pyautogui.hotkey(*args)
+            elif action == "press":
+                pyautogui.press(args[0])
+            elif action == "write":
+                pyautogui.write(args[0], interval=0)
+            elif action == "paste":
+                pyperclip.copy(args[0])
+                pyautogui.hotkey(PASTE_KEY, "v")
+            elif action == "sleep":
+                time.sleep(args[0])
+    finally:
+        pyautogui.PAUSE = previous_pause
+
+
+def fill_table_from_records(image_path: str, records: list, columns: list | None = None,
+                            offset=(0, 0), scale=(1.0, 1.0), resize: bool = True,
+                            anchor_each_row: bool = False) -> list:
+    """
+    Fill html/table.html with `records` using one Gemini call and a keyboard plan.
+    Returns the column order used (rename the headers to match if needed).
+    """
+    columns, grid = records_to_grid(records, columns)
+    if not grid:
+        print("No records to fill.")
+        return columns
+
+    detection = call_gemini_for_table_geometry(image_path)
+    if not detection:
+        print("No table geometry from Gemini. Exiting.")
+        return columns
+    geometry = table_geometry_from_detection(detection, offset=offset, scale=scale)
+    plan = build_table_fill_plan(grid, geometry, resize=resize, anchor_each_row=anchor_each_row)
+
+    print(f"\n=== [4b] Filling a {len(grid)}x{len(columns)} table ({len(plan)} actions) ===")
+    print(f"Column order: {columns}")
+    print("Starting in 3 seconds... Switch to your target window!")
+    time.sleep(3)
+
+    start = time.perf_counter()
+    execute_table_fill_plan(plan)
+    print(f"Filled {len(grid) * len(columns)} cells in {time.perf_counter() - start:.1f}s")
+    return columns
+
+
 # -----------------------------------------------------------------------------
 # Putting it all together in a single "main" flow
 # -----------------------------------------------------------------------------
@@ -248,8 +554,17 @@ class UnifiedFormExtractor:
         self.form_image_path = form_image_path
         self.model_code = ""
         self.parsed_locations = []
+        self.extracted_data = {}
+
+    def run_pipeline(self, fill: bool = True):
+        """
+        Run every step as one run in the run store. fill=False stops before
+        PyAutoGUI, which is how `run_store.py replay` re-runs a recording offline.
+        """
+        with get_run_store().run(self.form_image_path, kind="pipeline"):
+            self._run_steps(fill)
 
-    def run_pipeline(self):
+    def _run_steps(self, fill: bool):
         # Step 1: Anthropic -> get Pydantic code
         raw_claude_output = call_anthropic_for_pydantic(self.form_image_path)
         code = extract_python_code(raw_claude_output)
@@ -267,7 +582,16 @@ class UnifiedFormExtractor:
         self.parsed_locations = gemini_data
 
         # For demonstration, let's say the user has the text in the clipboard
-        text_in_clipboard = pyperclip.paste()
+        from model_router import route_model
+
+        def read_clipboard():
+            import pyperclip
+            return pyperclip.paste()
+
+        # Recorded too, so a replay sees the same clipboard text
+        text_in_clipboard, _ = get_run_store().call(
+            "clipboard", self.form_image_path, {"source": "clipboard"}, read_clipboard, cacheable=False,
+        )
         if not text_in_clipboard.strip():
             print("Clipboard is empty. Copy some text first. Exiting.")
             return
@@ -280,15 +604,22 @@ class UnifiedFormExtractor:
             "Return valid JSON with exactly these keys: ['name','email','phone']. "
             "Set missing fields to null."
         )
-        openai_json_string = parse_text_with_openai(text_in_clipboard, system_instructions)
+        route = route_model(text_in_clipboard, ["name", "email", "phone"])
+        print(f"[Router] {route.tier} tier ({route.model}): {route.reason}")
+        from structured_output import StructuredOutputError, fields_model
 
-        # Step 4: Convert the returned JSON string to a dict
         try:
-            extracted_data = json.loads(openai_json_string)
-        except json.JSONDecodeError:
-            print("OpenAI's response wasn't valid JSON. Response was:\n", openai_json_string)
+            openai_json_string = parse_text_with_openai(text_in_clipboard, system_instructions,
+                                                        model=route.model, form=self.form_image_path,
+                                                        schema=fields_model(["name", "email", "phone"]))
+        except StructuredOutputError as e:
+            print(f"OpenAI's response wasn't valid JSON ({e}). Response was:\n", e.raw)
             return
 
+        # Step 4: Convert the returned (already validated) JSON string to a dict
+        extracted_data = json.loads(openai_json_string)
+        self.extracted_data = extracted_data
+
         # Let’s assume the location labels from Gemini are "Name", "Email", "Phone"
         # or you can do some best-guess matching. We'll do a naive approach:
         #   - "label" from gemini might be "Name", "Email", "Phone" (case sensitive)
@@ -305,14 +636,324 @@ class UnifiedFormExtractor:
         # Step 5: Fill the fields with PyAutoGUI
         # If the points from Gemini are in range [0..1000], you need a suitable offset
         # or scaling to match actual screen coords. Let's assume offset=(0,0) for now.
+        if not fill:
+            print("\n[Replay] Skipping PyAutoGUI fill. Extracted data:", text_fields_for_gui)
+            return
         automate_text_input(self.parsed_locations, text_fields_for_gui, offset=(0, 0))
 
 
-def main():
-    # Provide your local screenshot path of the form
-    screenshot_path = "./assets/contact_form_google.png"  # or whichever form screenshot you have
-    pipeline = UnifiedFormExtractor(screenshot_path)
+# -----------------------------------------------------------------------------
+# Batch mode: a directory or glob of screenshots -> one consolidated output
+# -----------------------------------------------------------------------------
+#
+#   python copy_structured.py run --batch ./assets --out batch_output.json
+#
+# Images are read, downscaled and base64-encoded in a process pool, then the
+# Claude (model) and Gemini (locations) calls for every image run concurrently
+# in threads, bounded by --concurrency. The output file is rewritten after
+# every image, so re-running the same command skips forms that already
+# succeeded (matched by normalized path and content hash, so `./assets` and
+# `assets` resume each other) and retries the failed ones.
+
+BATCH_IMAGE_PATTERNS = ("*.png", "*.jpg", "*.jpeg")
+BATCH_MAX_WIDTH = 1600
+
+
+def collect_screenshots(source: str) -> list:
+    """A directory (all images in it) or a glob pattern -> sorted list of normalized paths."""
+    if os.path.isdir(source):
+        paths = []
+        for pattern in BATCH_IMAGE_PATTERNS:
+            paths.extend(glob.glob(os.path.join(source, pattern)))
+    else:
+        paths = glob.glob(source)
+    return sorted({os.path.normpath(path) for path in paths})
+
+
+def preprocess_screenshot(image_path: str) -> dict:
+    """
+    Runs in a worker process: hash the file, downscale it to BATCH_MAX_WIDTH
+    (if Pillow is installed) and base64-encode it as PNG.
+    Gemini's points are normalized to 0-1000, so downscaling doesn't move them.
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    try:
+        from PIL import Image
+        from io import BytesIO
+
+        image = Image.open(BytesIO(data))
+        if image.width > BATCH_MAX_WIDTH or image.format != "PNG":
+            if image.width > BATCH_MAX_WIDTH:
+                height = round(image.height * BATCH_MAX_WIDTH / image.width)
+                image = image.resize((BATCH_MAX_WIDTH, height))
+            buffered = BytesIO()
+            image.save(buffered, format="PNG")
+            data = buffered.getvalue()
+    except ImportError:
+        pass
+
+    return {"path": image_path, "sha256": sha256, "image_b64": base64.b64encode(data).decode("utf-8")}
+
+
+def _load_batch_output(out_path: str) -> dict:
+    if os.path.exists(out_path):
+        with open(out_path) as f:
+            output = json.load(f)
+        # Older files were keyed by the raw glob path ("./assets/a.png")
+        output["forms"] = {os.path.normpath(path): entry for path, entry in output["forms"].items()}
+        return output
+    return {"forms": {}}
+
+
+def _save_batch_output(out_path: str, output: dict):
+    # Write-then-rename so an interrupted run never leaves a truncated file
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(output, f, indent=2)
+    os.replace(tmp_path, out_path)
+
+
+async def _run_batch_async(images: list, output: dict, out_path: str, concurrency: int) -> dict:
+    import asyncio
+
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"ok": 0, "failed": 0}
+    done = 0
+
+    async def process(image: dict):
+        nonlocal done
+        async with semaphore:
+            try:
+                # One run per image in the run store; asyncio.to_thread copies the
+                # context, so the calls in the worker threads are grouped under it
+                with get_run_store().run(image["path"], kind="batch"):
+                    # Claude and Gemini for the same image also overlap
+                    model_task = asyncio.to_thread(call_anthropic_for_pydantic, image["path"], image["image_b64"])
+                    locations_task = asyncio.to_thread(call_gemini_for_locations, image["path"], image["image_b64"])
+                    start = time.perf_counter()
+                    raw_claude_output, locations = await asyncio.gather(model_task, locations_task)
+                    model_code = extract_python_code(raw_claude_output)
+                    entry = {
+                        "sha256": image["sha256"],
+                        "model_code": model_code,
+                        "locations": locations,
+                        "seconds": round(time.perf_counter() - start, 2),
+                        "status": "ok" if model_code and locations else "failed",
+                    }
+                    if entry["status"] == "failed":
+                        entry["error"] = "empty model code" if not model_code else "no locations"
+            except Exception as e:
+                entry = {"sha256": image["sha256"], "status": "failed", "error": str(e)}
+
+        counts[entry["status"]] += 1
+        done += 1
+        output["forms"][image["path"]] = entry
+        _save_batch_output(out_path, output)
+        print(f"[{done}/{len(images)}] {image['path']}: {entry['status']}"
+              + (f" ({entry['seconds']}s)" if "seconds" in entry else f" - {entry.get('error')}"))
+
+    await asyncio.gather(*(process(image) for image in images))
+    return counts
+
+
+def run_batch(source: str, out_path: str = "batch_output.json", concurrency: int = 4,
+              workers: int | None = None) -> dict:
+    """
+    Extract models and field locations for every screenshot under 'source'
+    into 'out_path'. Returns a summary dict (also printed).
+    """
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+
+    start = time.perf_counter()
+    paths = collect_screenshots(source)
+    output = _load_batch_output(out_path)
+    print(f"\n=== Batch mode: {len(paths)} screenshots from {source} -> {out_path} ===")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(preprocess_screenshot, paths))
+
+    pending = []
+    for image in images:
+        previous = output["forms"].get(image["path"])
+        if previous and previous.get("status") == "ok" and previous.get("sha256") == image["sha256"]:
+            continue
+        pending.append(image)
+    skipped = len(images) - len(pending)
+    if skipped:
+        print(f"Resuming: {skipped} already done, {len(pending)} to process")
+
+    counts = asyncio.run(_run_batch_async(pending, output, out_path, concurrency))
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "total": len(images),
+        "processed": len(pending),
+        "skipped": skipped,
+        "ok": counts["ok"],
+        "failed": counts["failed"],
+        "elapsed_seconds": round(elapsed, 2),
+        "forms_per_minute": round(len(pending) / elapsed * 60, 2) if elapsed else 0.0,
+    }
+    print("\n=== Batch summary ===")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+    if counts["failed"]:
+        print("Re-run the same command to retry the failed forms.")
+    return summary
+
+
+# -----------------------------------------------------------------------------
+# Command line: one subcommand per stage
+# -----------------------------------------------------------------------------
+
+DEFAULT_SCREENSHOT = "./assets/contact_form_google.png"  # or whichever form screenshot you have
+
+
+def _write_or_print(content: str, out_path: str | None):
+    if out_path:
+        with open(out_path, "w") as f:
+            f.write(content)
+        print(f"Saved to: {out_path}")
+    else:
+        print(content)
+
+
+def cmd_model(args):
+    code = extract_python_code(call_anthropic_for_pydantic(args.image))
+    if not code:
+        print("No <python> ... </python> code was found in Claude's response.")
+        return 1
+    _write_or_print(code + "\n", args.out)
+    return 0
+
+
+def cmd_locate(args):
+    if args.table:
+        locations = call_gemini_for_table_geometry(args.image)
+    else:
+        locations = call_gemini_for_locations(args.image)
+    if not locations:
+        return 1
+    _write_or_print(json.dumps(locations, indent=2), args.out)
+    return 0
+
+
+def cmd_parse(args):
+    from model_router import route_model
+
+    if args.file:
+        with open(args.file) as f:
+            text = f.read()
+    elif args.text:
+        text = args.text
+    else:
+        import pyperclip
+        text = pyperclip.paste()
+    if not text.strip():
+        print("No text to parse. Copy some text first or pass --text/--file.")
+        return 1
+
+    instructions = (
+        "You are an assistant that extracts the following fields from the user's text. "
+        f"Return valid JSON with exactly these keys: {args.fields}. "
+        "Set missing fields to null."
+    )
+    route = route_model(text, args.fields)
+    print(f"[Router] {route.tier} tier ({route.model}): {route.reason}")
+    from structured_output import StructuredOutputError, fields_model
+
+    try:
+        result = parse_text_with_openai(text, instructions, model=args.model or route.model,
+                                        schema=fields_model(args.fields))
+    except StructuredOutputError as e:
+        print(f"OpenAI's response wasn't valid JSON ({e}). Response was:\n", e.raw)
+        return 1
+    _write_or_print(result, args.out)
+    return 0
+
+
+def cmd_fill(args):
+    with open(args.data) as f:
+        data = json.load(f)
+    if args.table:
+        fill_table_from_records(args.table, data, offset=tuple(args.offset), scale=tuple(args.scale),
+                                resize=not args.no_resize)
+        return 0
+    if not args.locations:
+        print("fill needs --locations (form fields) or --table (table screenshot).")
+        return 1
+    with open(args.locations) as f:
+        locations = json.load(f)
+    automate_text_input(locations, data, offset=tuple(args.offset))
+    return 0
+
+
+def cmd_run(args):
+    if args.batch:
+        summary = run_batch(args.batch, args.out, concurrency=args.concurrency, workers=args.workers)
+        return 1 if summary["failed"] else 0
+    pipeline = UnifiedFormExtractor(args.image)
     pipeline.run_pipeline()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Form screenshot -> Pydantic model, locations and autofill.")
+    commands = parser.add_subparsers(dest="command", metavar="{model,locate,parse,fill,run}")
+
+    model = commands.add_parser("model", help="screenshot -> Pydantic model code (Claude)")
+    model.add_argument("image", help="form screenshot")
+    model.add_argument("--out", help="write the model code here instead of stdout")
+    model.set_defaults(handler=cmd_model)
+
+    locate = commands.add_parser("locate", help="screenshot -> field coordinates JSON (Gemini)")
+    locate.add_argument("image", help="form screenshot")
+    locate.add_argument("--table", action="store_true", help="detect table geometry instead of form fields")
+    locate.add_argument("--out", help="write the JSON here instead of stdout")
+    locate.set_defaults(handler=cmd_locate)
+
+    parse = commands.add_parser("parse", help="text or clipboard -> JSON (OpenAI)")
+    source = parse.add_mutually_exclusive_group()
+    source.add_argument("--text", help="text to parse (default: clipboard)")
+    source.add_argument("--file", help="read the text to parse from a file")
+    parse.add_argument("--fields", nargs="+", default=["name", "email", "phone"], help="keys to extract")
+    parse.add_argument("--model", help="OpenAI model (default: chosen by model_router)")
+    parse.add_argument("--out", help="write the JSON here instead of stdout")
+    parse.set_defaults(handler=cmd_parse)
+
+    fill = commands.add_parser("fill", help="type extracted data into the screen (PyAutoGUI)")
+    fill.add_argument("data", help="JSON: {label: text} for form fields, or a list of records for --table")
+    fill.add_argument("--locations", help="JSON from `locate` with the form field points")
+    fill.add_argument("--table", metavar="IMAGE", help="bulk-fill html/table.html shown in this screenshot")
+    fill.add_argument("--no-resize", action="store_true", help="don't resize the table to the records")
+    fill.add_argument("--offset", nargs=2, type=float, default=[0, 0], metavar=("X", "Y"))
+    fill.add_argument("--scale", nargs=2, type=float, default=[1.0, 1.0], metavar=("X", "Y"))
+    fill.set_defaults(handler=cmd_fill)
+
+    run = commands.add_parser("run", help="the whole pipeline, or --batch over many screenshots")
+    run.add_argument("image", nargs="?", default=DEFAULT_SCREENSHOT,
+                     help="screenshot of the form for the single-form pipeline")
+    run.add_argument("--batch", metavar="DIR_OR_GLOB",
+                     help="extract models and locations for every screenshot in a directory or glob")
+    run.add_argument("--out", default="batch_output.json", help="consolidated batch output (JSON)")
+    run.add_argument("--concurrency", type=int, default=4, help="max forms in flight at once")
+    run.add_argument("--workers", type=int, default=None, help="preprocessing processes")
+    run.set_defaults(handler=cmd_run)
+
+    return parser
+
+
+def main(argv: list | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # No subcommand: keep the old behaviour of running the whole pipeline
+        args = parser.parse_args(["run"])
+    return args.handler(args)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
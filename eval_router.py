@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""
+Offline eval harness for model_router.py.
+
+Runs every sample in the test_samples_* corpora through the app.py extractors
+once per model tier, scores field-level accuracy against test_samples_gold.json
+and records latency. From those measurements it derives router thresholds
+(the largest input length / schema size where the small tier stays within
+`--tolerance` of the large tier's accuracy) and can write them to
+router_thresholds.json, which model_router.load_thresholds picks up.
+
+Extractor failures (missing key, network, rate limits) are recorded per row
+as `error` and excluded from scoring. Thresholds are not written when any
+row errored or the large tier scored 0, since that measures the setup, not
+the models.
+
+Only max_fields_small and max_chars_small are derived. The corpora are
+short (the longest sample is under 300 characters), so they cannot show where
+the small tier starts to degrade: if it holds up on every sample,
+max_chars_small (and likewise max_fields_small) is kept at no less than the
+ROUTER_THRESHOLDS value rather than lowered to the largest sample seen. min_prefill_ratio
+and prefill_chars_multiplier keep their ROUTER_THRESHOLDS defaults: the
+corpora are too small to measure them, so they remain hand-picked.
+
+Usage:
+  python eval_router.py                         # run all tiers, print report
+  python eval_router.py --out eval_results.json --write-thresholds
+  python eval_router.py --from-results eval_results.json --write-thresholds
+      (re-derive thresholds from a previous run, no API calls)
+"""
+
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from model_router import DEFAULT_THRESHOLDS_PATH, MODEL_TIERS, ROUTER_THRESHOLDS, route_model
+
+GOLD_PATH = "./test_samples_gold.json"
+
+# corpus name -> (samples file, app.py extractor, app.py model class)
+CORPORA = {
+    "contact": ("./test_samples_contact_form.txt", "extract_contact_info", "ContactInfo"),
+    "job": ("./test_samples_job_form.txt", "extract_job_info", "JobInfo"),
+}
+
+
+# -----------------------------------------------------------------------------
+# Loading and scoring
+# -----------------------------------------------------------------------------
+
+def load_samples(path: str) -> list:
+    """Split a corpus on blank lines, dropping any leading "N. " numbering."""
+    with open(path) as f:
+        blocks = re.split(r"\n\s*\n", f.read())
+    samples = []
+    for block in blocks:
+        text = re.sub(r"^\s*\d+\.\s*", "", block.strip())
+        if text:
+            samples.append(" ".join(line.strip() for line in text.splitlines()))
+    return samples
+
+
+def _normalize(value) -> str:
+    return re.sub(r"[^a-z0-9@]+", " ", str(value or "").lower()).strip()
+
+
+def field_matches(name: str, predicted, expected) -> bool:
+    """Phones compare on digits; everything else on normalized text (containment allowed)."""
+    if expected is None:
+        return predicted in (None, "")
+    if "phone" in name:
+        return re.sub(r"\D", "", str(predicted or "")) == re.sub(r"\D", "", str(expected))
+    pred, gold = _normalize(predicted), _normalize(expected)
+    return bool(pred) and (pred == gold or gold in pred)
+
+
+def score_record(predicted: dict, expected: dict) -> float:
+    hits = sum(field_matches(name, predicted.get(name), value) for name, value in expected.items())
+    return hits / len(expected)
+
+
+# -----------------------------------------------------------------------------
+# Running the tiers
+# -----------------------------------------------------------------------------
+
+def run_eval(tiers: list, corpora: list, limit: int | None = None) -> list:
+    """Call the extractors for every (corpus, sample, tier); return flat result rows."""
+    import app  # imported here so --from-results works without the API stack
+
+    with open(GOLD_PATH) as f:
+        gold = json.load(f)
+
+    rows = []
+    for corpus in corpora:
+        samples_path, extractor_name, model_name = CORPORA[corpus]
+        extractor = getattr(app, extractor_name)
+        n_fields = len(getattr(app, model_name).model_fields)
+        samples = load_samples(samples_path)[:limit]
+
+        for index, text in enumerate(samples):
+            expected = gold[corpus][index]
+            for tier in tiers:
+                start = time.perf_counter()
+                try:
+                    predicted, error = extractor(text, model=MODEL_TIERS[tier], raise_errors=True).model_dump(), None
+                except Exception as e:
+                    predicted, error = {}, f"{type(e).__name__}: {e}"
+                latency = time.perf_counter() - start
+                rows.append({
+                    "corpus": corpus,
+                    "index": index,
+                    "tier": tier,
+                    "chars": len(text),
+                    "fields": n_fields,
+                    "text": text,
+                    "latency": latency,
+                    "accuracy": None if error else score_record(predicted, expected),
+                    "predicted": predicted,
+                    "error": error,
+                })
+                if error:
+                    print(f"  {corpus}[{index}] {tier:<5} ERROR {error}")
+                else:
+                    print(f"  {corpus}[{index}] {tier:<5} acc={rows[-1]['accuracy']:.2f} {latency:.2f}s")
+    return rows
+
+
+# -----------------------------------------------------------------------------
+# Reporting and threshold derivation
+# -----------------------------------------------------------------------------
+
+def _summarize(rows: list) -> dict:
+    latencies = sorted(row["latency"] for row in rows)
+    p95_index = max(0, int(round(0.95 * len(latencies))) - 1)
+    return {
+        "n": len(rows),
+        "accuracy": statistics.mean(row["accuracy"] for row in rows),
+        "latency_mean": statistics.mean(latencies),
+        "latency_p50": statistics.median(latencies),
+        "latency_p95": latencies[p95_index],
+    }
+
+
+def scored_rows(rows: list) -> list:
+    """Rows whose extraction succeeded (errored rows carry no accuracy)."""
+    return [row for row in rows if not row.get("error")]
+
+
+def _by_sample(rows: list) -> dict:
+    """{(corpus, index): {tier: row}}"""
+    table = {}
+    for row in rows:
+        table.setdefault((row["corpus"], row["index"]), {})[row["tier"]] = row
+    return table
+
+
+def derive_thresholds(rows: list, tolerance: float) -> dict:
+    """
+    Largest schema size and input length at which the small tier's accuracy is
+    within `tolerance` of the large tier's on the same samples.
+    """
+    thresholds = dict(ROUTER_THRESHOLDS)
+    paired = [tiers for tiers in _by_sample(scored_rows(rows)).values()
+              if "small" in tiers and "large" in tiers]
+    if not paired:
+        return thresholds
+
+    def small_holds_up(pairs):
+        small = statistics.mean(p["small"]["accuracy"] for p in pairs)
+        large = statistics.mean(p["large"]["accuracy"] for p in pairs)
+        return small >= large - tolerance
+
+    max_fields = 0
+    for n_fields in sorted({p["small"]["fields"] for p in paired}):
+        if small_holds_up([p for p in paired if p["small"]["fields"] <= n_fields]):
+            max_fields = n_fields
+        else:
+            break
+    if max_fields == max(p["small"]["fields"] for p in paired):
+        # Held up on the largest schema measured: also only a lower bound
+        max_fields = max(max_fields, ROUTER_THRESHOLDS["max_fields_small"])
+    thresholds["max_fields_small"] = max_fields
+
+    eligible = sorted((p for p in paired if p["small"]["fields"] <= max_fields),
+                      key=lambda p: p["small"]["chars"])
+    max_chars = 0
+    for i, pair in enumerate(eligible):
+        if small_holds_up(eligible[:i + 1]):
+            max_chars = pair["small"]["chars"]
+    if eligible and small_holds_up(eligible):
+        # No degradation observed: the data is only a lower bound
+        max_chars = max(max_chars, ROUTER_THRESHOLDS["max_chars_small"])
+    thresholds["max_chars_small"] = max_chars
+    return thresholds
+
+
+def routed_rows(rows: list, thresholds: dict) -> list:
+    """Simulate the router over recorded results: pick the row of the tier it would choose."""
+    picked = []
+    for tiers in _by_sample(scored_rows(rows)).values():
+        sample = next(iter(tiers.values()))
+        decision = route_model(sample["text"], list(sample["predicted"]), thresholds)
+        if decision.tier in tiers:
+            picked.append(tiers[decision.tier])
+    return picked
+
+
+def print_report(rows: list, thresholds: dict):
+    print("\n=== Accuracy / latency per tier ===")
+    print(f"{'corpus':<10}{'tier':<8}{'n':>4}{'acc':>8}{'mean s':>9}{'p50 s':>9}{'p95 s':>9}")
+    groups = {}
+    for row in scored_rows(rows):
+        groups.setdefault((row["corpus"], row["tier"]), []).append(row)
+    routed = routed_rows(rows, thresholds)
+    for row in routed:
+        groups.setdefault((row["corpus"], "routed"), []).append(row)
+    for (corpus, tier), group in sorted(groups.items()):
+        s = _summarize(group)
+        print(f"{corpus:<10}{tier:<8}{s['n']:>4}{s['accuracy']:>8.3f}"
+              f"{s['latency_mean']:>9.2f}{s['latency_p50']:>9.2f}{s['latency_p95']:>9.2f}")
+    errors = [row for row in rows if row.get("error")]
+    if errors:
+        print(f"\n{len(errors)} of {len(rows)} extractions failed (excluded from scoring):")
+        for row in errors:
+            print(f"  {row['corpus']}[{row['index']}] {row['tier']}: {row['error']}")
+    print("\n=== Derived thresholds ===")
+    print(json.dumps(thresholds, indent=2))
+
+
+def thresholds_problem(rows: list) -> str | None:
+    """Why the measured thresholds should not be persisted, or None if they can be."""
+    errors = sum(1 for row in rows if row.get("error"))
+    if errors:
+        return f"{errors} extraction(s) failed"
+    large = [row["accuracy"] for row in rows if row["tier"] == "large"]
+    if not large:
+        return "no large-tier results to compare against"
+    if statistics.mean(large) == 0:
+        return "large-tier accuracy is 0"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate model tiers for the extraction router.")
+    parser.add_argument("--tiers", nargs="+", default=list(MODEL_TIERS), choices=list(MODEL_TIERS))
+    parser.add_argument("--corpus", nargs="+", default=list(CORPORA), choices=list(CORPORA))
+    parser.add_argument("--limit", type=int, default=None, help="max samples per corpus")
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="accuracy drop allowed for the small tier (default 0.02)")
+    parser.add_argument("--out", help="save raw results JSON here")
+    parser.add_argument("--from-results", help="load raw results JSON instead of calling the API")
+    parser.add_argument("--write-thresholds", nargs="?", const=DEFAULT_THRESHOLDS_PATH,
+                        help=f"write derived thresholds (default {DEFAULT_THRESHOLDS_PATH})")
+    args = parser.parse_args()
+
+    if args.from_results:
+        with open(args.from_results) as f:
+            rows = json.load(f)["rows"]
+    else:
+        rows = run_eval(args.tiers, args.corpus, args.limit)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump({"created": datetime.now().isoformat(), "rows": rows}, f, indent=2)
+            print(f"Raw results saved to: {args.out}")
+
+    thresholds = derive_thresholds(rows, args.tolerance)
+    print_report(rows, thresholds)
+
+    if args.write_thresholds:
+        problem = thresholds_problem(rows)
+        if problem:
+            print(f"Not writing thresholds: {problem}. Fix the setup and re-run.")
+            return 1
+        with open(args.write_thresholds, "w") as f:
+            json.dump({
+                "created": datetime.now().isoformat(),
+                "tolerance": args.tolerance,
+                "samples": len(_by_sample(rows)),
+                "thresholds": thresholds,
+            }, f, indent=2)
+        print(f"Thresholds written to: {args.write_thresholds}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Pick an OpenAI model tier per extraction request.
+
+A three-line contact snippet does not need the same model as a long course
+proposal. `route_model` looks at:
+  - the input length (characters)
+  - the schema size (number of fields to extract)
+  - a local, regex-based pre-extraction: if the cheap pass already finds most
+    of the fields (emails, phone numbers, URLs), the text is easy
+
+and returns the small or large tier. Routing only starts once `eval_router.py`
+has written measured thresholds to a JSON file; until then every request goes
+to the large tier (the behaviour before routing existed). ROUTER_THRESHOLDS
+only fills in keys the eval does not derive.
+
+Environment variables:
+  - MODEL_ROUTER_THRESHOLDS  path to a thresholds JSON (default ./router_thresholds.json)
+  - MODEL_ROUTER_FORCE       "small" or "large" to bypass routing
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+
+MODEL_TIERS = {
+    "small": "gpt-4o-mini",
+    "large": "gpt-4o",
+}
+
+# Base values merged under the measured thresholds; never used on their own.
+ROUTER_THRESHOLDS = {
+    "max_chars_small": 400,
+    "max_fields_small": 4,
+    "min_prefill_ratio": 0.5,
+    "prefill_chars_multiplier": 2.0,
+}
+
+DEFAULT_THRESHOLDS_PATH = "./router_thresholds.json"
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+PHONE_RE = re.compile(r"(?:\+?\d[\d\s().-]{6,}\d)")
+URL_RE = re.compile(r"https?://\S+|www\.\S+")
+
+# Field-name keywords -> regex that can fill them without a model call.
+_PREFILL_PATTERNS = [
+    (("email", "mail"), EMAIL_RE),
+    (("phone", "mobile", "tel"), PHONE_RE),
+    (("url", "website", "link"), URL_RE),
+]
+
+
+@dataclass
+class RouteDecision:
+    tier: str
+    model: str
+    reason: str
+    features: dict = field(default_factory=dict)
+
+
+def _schema_fields(schema) -> list:
+    """Accept a pydantic model class, an instance, or a plain list of field names."""
+    if hasattr(schema, "model_fields"):
+        return list(schema.model_fields)
+    return list(schema)
+
+
+def pre_extract(text: str, fields: list) -> dict:
+    """
+    Fast local pass: fill whichever fields a regex can find.
+    Returns {field_name: value} for the fields that were found.
+    """
+    found = {}
+    for name in fields:
+        lowered = name.lower()
+        for keywords, pattern in _PREFILL_PATTERNS:
+            if any(keyword in lowered for keyword in keywords):
+                match = pattern.search(text)
+                if match:
+                    found[name] = match.group(0).strip()
+                break
+    return found
+
+
+def load_thresholds(path: str | None = None) -> dict | None:
+    """Thresholds from the eval JSON (over ROUTER_THRESHOLDS), or None if it doesn't exist."""
+    path = path or os.getenv("MODEL_ROUTER_THRESHOLDS", DEFAULT_THRESHOLDS_PATH)
+    if not os.path.exists(path):
+        return None
+    thresholds = dict(ROUTER_THRESHOLDS)
+    with open(path) as f:
+        thresholds.update(json.load(f).get("thresholds", {}))
+    return thresholds
+
+
+_thresholds_cache = {}
+
+
+def _thresholds() -> dict | None:
+    if "value" not in _thresholds_cache:
+        _thresholds_cache["value"] = load_thresholds()
+    return _thresholds_cache["value"]
+
+
+def route_model(text: str, schema, thresholds: dict | None = None) -> RouteDecision:
+    """Choose a model tier for extracting `schema` from `text`."""
+    fields = _schema_fields(schema)
+    prefilled = pre_extract(text, fields)
+    features = {
+        "chars": len(text),
+        "fields": len(fields),
+        "prefill_ratio": round(len(prefilled) / len(fields), 3) if fields else 0.0,
+    }
+
+    forced = os.getenv("MODEL_ROUTER_FORCE")
+    if forced in MODEL_TIERS:
+        return RouteDecision(forced, MODEL_TIERS[forced], "forced by MODEL_ROUTER_FORCE", features)
+
+    t = thresholds or _thresholds()
+    if t is None:
+        return RouteDecision("large", MODEL_TIERS["large"],
+                             "no measured thresholds yet (run eval_router.py)", features)
+    if features["fields"] > t["max_fields_small"]:
+        tier, reason = "large", f"schema has {features['fields']} fields (> {t['max_fields_small']})"
+    elif features["chars"] <= t["max_chars_small"]:
+        tier, reason = "small", f"short input ({features['chars']} <= {t['max_chars_small']} chars)"
+    elif (features["prefill_ratio"] >= t["min_prefill_ratio"]
+          and features["chars"] <= t["max_chars_small"] * t["prefill_chars_multiplier"]):
+        tier, reason = "small", f"pre-extraction found {features['prefill_ratio']:.0%} of fields"
+    else:
+        tier, reason = "large", f"long input ({features['chars']} chars)"
+
+    return RouteDecision(tier, MODEL_TIERS[tier], reason, features)
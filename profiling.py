@@ -0,0 +1,268 @@
+"""
+Opt-in profiling hooks for the extraction server (app.py).
+
+Everything here is OFF by default. When PROFILING_ENABLED is not set,
+`install_profiling(app)` returns immediately: no middleware, no routes,
+no sampler thread and no tracemalloc, so the request path is untouched.
+
+When enabled it provides:
+  - a sampling CPU profiler (a background thread reading sys._current_frames)
+    that can run per request (send the `X-Profile: 1` header) or over a time
+    window (`/admin/profile/start` + `/admin/profile/stop`)
+  - tracemalloc snapshots with a diff against the previous snapshot
+    (`/admin/memory/snapshot`)
+  - output in the "collapsed stack" format (`frame;frame;frame count`),
+    which flamegraph.pl, speedscope and inferno all read directly
+
+Environment variables:
+  - PROFILING_ENABLED     "1"/"true" to install the hooks
+  - PROFILING_OUTPUT_DIR  where .folded / .txt files go (default ./profiles)
+  - PROFILING_INTERVAL    sampling interval in seconds (default 0.005)
+  - PROFILING_TOKEN       required: admin routes and the header only act
+                          with `X-Profile-Token: <token>`. Without a token
+                          the hooks are not installed, since the routes start
+                          threads, start tracemalloc and write files.
+"""
+
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+PROFILE_HEADER = "x-profile"
+TOKEN_HEADER = "x-profile-token"
+
+
+def profiling_enabled() -> bool:
+    """True if PROFILING_ENABLED is set to a truthy value."""
+    return os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+
+def _output_dir() -> str:
+    path = os.getenv("PROFILING_OUTPUT_DIR", "./profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _timestamped_path(prefix: str, suffix: str) -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(_output_dir(), f"{prefix}_{timestamp}{suffix}")
+
+
+# -----------------------------------------------------------------------------
+# 1) Sampling CPU profiler
+# -----------------------------------------------------------------------------
+
+class StackSampler:
+    """
+    Samples the Python stacks of all other threads every `interval` seconds
+    and counts identical stacks. Unlike cProfile it does not hook every call,
+    so the overhead is bounded by the sampling rate rather than by how much
+    JSON/pydantic work the request does.
+
+    Note: samples cover every thread in the process, so concurrent requests
+    show up in each other's per-request profile.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.perf_counter()
+        return self
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                self.counts[self._collapse(frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            stack.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def to_collapsed(self) -> str:
+        """Render samples as `stack count` lines (flamegraph-compatible)."""
+        lines = [f"{stack} {count}" for stack, count in self.counts.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> str:
+        with open(path, "w") as f:
+            f.write(self.to_collapsed())
+        return path
+
+    def summary(self) -> dict:
+        elapsed = (self.stopped_at or time.perf_counter()) - (self.started_at or 0.0)
+        return {
+            "samples": self.samples,
+            "unique_stacks": len(self.counts),
+            "elapsed_seconds": round(elapsed, 4),
+            "interval_seconds": self.interval,
+        }
+
+
+# -----------------------------------------------------------------------------
+# 2) tracemalloc snapshots with diffs
+# -----------------------------------------------------------------------------
+
+class MemoryTracker:
+    """
+    Takes tracemalloc snapshots and diffs each one against the previous one.
+    tracemalloc is only started on the first snapshot request, so there is
+    no allocation-tracking overhead until someone asks for it.
+    """
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, top: int = 20) -> dict:
+        with self._lock:
+            return self._snapshot(top)
+
+    def _snapshot(self, top: int) -> dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._previous = tracemalloc.take_snapshot()
+            return {"status": "tracemalloc started; call again for a diff", "diff": []}
+
+        current = tracemalloc.take_snapshot()
+        stats = current.compare_to(self._previous, "lineno")
+        self._previous = current
+
+        lines = [str(stat) for stat in stats[:top]]
+        path = _timestamped_path("memory_diff", ".txt")
+        with open(path, "w") as f:
+            f.write("\n".join(str(stat) for stat in stats) + "\n")
+
+        size, peak = tracemalloc.get_traced_memory()
+        return {
+            "status": "ok",
+            "traced_bytes": size,
+            "peak_bytes": peak,
+            "diff": lines,
+            "file": path,
+        }
+
+    def stop(self):
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._previous = None
+
+
+# -----------------------------------------------------------------------------
+# 3) FastAPI wiring
+# -----------------------------------------------------------------------------
+
+def install_profiling(app) -> bool:
+    """
+    Attach the profiling middleware and admin routes to `app`.
+    Does nothing (and returns False) unless PROFILING_ENABLED is set, and
+    refuses to install anything if PROFILING_TOKEN is missing.
+    Blocking work (joining the sampler thread, tracemalloc snapshots/diffs,
+    writing files) runs in the threadpool, not on the event loop.
+    """
+    if not profiling_enabled():
+        return False
+
+    token = os.getenv("PROFILING_TOKEN")
+    if not token:
+        print("PROFILING_ENABLED is set but PROFILING_TOKEN is not; profiling hooks NOT installed")
+        return False
+
+    from fastapi import HTTPException, Request
+    from fastapi.concurrency import run_in_threadpool
+
+    interval = float(os.getenv("PROFILING_INTERVAL", "0.005"))
+    memory = MemoryTracker()
+    window = {"sampler": None}
+
+    def token_ok(request: Request) -> bool:
+        return hmac.compare_digest(request.headers.get(TOKEN_HEADER, "").encode(), token.encode())
+
+    def check_token(request: Request):
+        if not token_ok(request):
+            raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+    def stop_and_write(sampler: StackSampler, prefix: str) -> str:
+        sampler.stop()
+        return sampler.write(_timestamped_path(prefix, ".folded"))
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        if request.headers.get(PROFILE_HEADER) not in ("1", "true") or not token_ok(request):
+            return await call_next(request)
+
+        sampler = StackSampler(interval).start()
+        prefix = "request" + request.url.path.replace("/", "_")
+        try:
+            response = await call_next(request)
+        except BaseException:
+            await run_in_threadpool(sampler.stop)
+            raise
+        path = await run_in_threadpool(stop_and_write, sampler, prefix)
+        response.headers["X-Profile-File"] = path
+        response.headers["X-Profile-Samples"] = str(sampler.samples)
+        return response
+
+    @app.post("/admin/profile/start")
+    async def profile_start(request: Request):
+        check_token(request)
+        if window["sampler"] is not None:
+            raise HTTPException(status_code=409, detail="A profiling window is already running")
+        window["sampler"] = StackSampler(interval).start()
+        return {"status": "started", "interval_seconds": interval}
+
+    @app.post("/admin/profile/stop")
+    async def profile_stop(request: Request):
+        check_token(request)
+        sampler = window["sampler"]
+        if sampler is None:
+            raise HTTPException(status_code=409, detail="No profiling window is running")
+        window["sampler"] = None
+        path = await run_in_threadpool(stop_and_write, sampler, "window")
+        return {"status": "stopped", "file": path, **sampler.summary()}
+
+    @app.post("/admin/memory/snapshot")
+    async def memory_snapshot(request: Request, top: int = 20):
+        check_token(request)
+        return await run_in_threadpool(memory.snapshot, top)
+
+    @app.post("/admin/memory/stop")
+    async def memory_stop(request: Request):
+        check_token(request)
+        await run_in_threadpool(memory.stop)
+        return {"status": "stopped"}
+
+    print(f"Profiling hooks enabled (interval={interval}s, output={_output_dir()})")
+    return True
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+
+"""
+Append-only run store for the extraction pipeline (SQLite).
+
+Every model call made by copy_structured.py and the app.py extractors goes
+through `RunStore.call`, which records one row per stage:
+  - the stage name, form and model
+  - a hash of the inputs (and the inputs themselves; screenshots are stored
+    as path + content hash, not pixels)
+  - the raw response text and the parsed output
+  - timings and token counts
+
+Rows are grouped into runs (one pipeline run, one batch image, one app.py
+extraction) and indexed by form and by time. Nothing is ever updated or
+deleted; this replaces the timestamped form_analysis_raw_*.txt dumps.
+
+Modes (RUN_STORE_MODE):
+  - record  (default) call the API and record the stage
+  - replay  never touch the network: serve every stage from the store
+  - cache   serve a stage from the store if the same inputs were seen before,
+            otherwise call the API and record it (stored inputs = warm cache)
+  - off     call the API, record nothing
+
+Command line:
+  python run_store.py list [--form FORM] [--since 2025-04-13] [--limit 20]
+  python run_store.py show RUN_ID
+  python run_store.py replay RUN_ID       # re-run offline, diff against the recording
+  python run_store.py import-legacy form_analysis_raw_*.txt [--locs locs.csv] [--form FORM]
+"""
+
+import argparse
+import contextvars
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+DEFAULT_STORE_PATH = "./runs.sqlite3"
+MODES = ("record", "replay", "cache", "off")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    form        TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    started_at  REAL NOT NULL,
+    replay_of   INTEGER REFERENCES runs(id)
+);
+CREATE TABLE IF NOT EXISTS stages (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id         INTEGER REFERENCES runs(id),
+    form           TEXT NOT NULL,
+    stage          TEXT NOT NULL,
+    model          TEXT,
+    inputs_hash    TEXT NOT NULL,
+    inputs         TEXT,
+    raw_response   TEXT,
+    parsed_output  TEXT,
+    error          TEXT,
+    started_at     REAL NOT NULL,
+    duration       REAL NOT NULL,
+    input_tokens   INTEGER,
+    output_tokens  INTEGER,
+    replayed       INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_form_time ON runs (form, started_at);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (started_at);
+CREATE INDEX IF NOT EXISTS stages_run ON stages (run_id, id);
+CREATE INDEX IF NOT EXISTS stages_form_time ON stages (form, started_at);
+CREATE INDEX IF NOT EXISTS stages_lookup ON stages (stage, inputs_hash, replayed);
+"""
+
+_current_run = contextvars.ContextVar("run_store_current_run", default=None)
+_replay_source = contextvars.ContextVar("run_store_replay_source", default=None)
+
+
+class ReplayMiss(KeyError):
+    """Replay mode found no recorded response for a stage."""
+
+
+def hash_inputs(inputs: dict) -> str:
+    """Stable sha256 of a JSON-serializable inputs dict."""
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def usage_from_response(response) -> tuple:
+    """(input_tokens, output_tokens) from an OpenAI, Anthropic or Gemini response, if present."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return (getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", None),
+                getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", None))
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is not None:
+        return (getattr(metadata, "prompt_token_count", None),
+                getattr(metadata, "candidates_token_count", None))
+    return (None, None)
+
+
+class RunStore:
+    def __init__(self, path: str = DEFAULT_STORE_PATH, mode: str = "record"):
+        if mode not in MODES:
+            raise ValueError(f"RUN_STORE_MODE must be one of {MODES}, got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self._conn = None
+        self._lock = threading.Lock()
+        self._replay_cursor = {}
+
+    # -- connection -----------------------------------------------------------
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3
+
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _insert(self, sql: str, params: tuple) -> int:
+        with self._lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cursor.lastrowid
+
+    # -- recording ------------------------------------------------------------
+
+    @contextmanager
+    def run(self, form: str, kind: str, started_at: float | None = None):
+        """Group the stages recorded inside this block into one run."""
+        if self.mode == "off":
+            yield None
+            return
+        replay_of = _replay_source.get()
+        run_id = self._insert(
+            "INSERT INTO runs (form, kind, started_at, replay_of) VALUES (?, ?, ?, ?)",
+            (form, kind, started_at or time.time(), replay_of),
+        )
+        token = _current_run.set(run_id)
+        try:
+            yield run_id
+        finally:
+            _current_run.reset(token)
+
+    def record_stage(self, stage: str, form: str, inputs: dict, raw_response, parsed_output=None,
+                     model: str | None = None, error: str | None = None, started_at: float | None = None,
+                     duration: float = 0.0, usage: tuple = (None, None), replayed: bool = False,
+                     run_id: int | None = None) -> int:
+        return self._insert(
+            "INSERT INTO stages (run_id, form, stage, model, inputs_hash, inputs, raw_response, "
+            "parsed_output, error, started_at, duration, input_tokens, output_tokens, replayed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id if run_id is not None else _current_run.get(), form, stage, model,
+             hash_inputs(inputs), json.dumps(inputs, default=str), raw_response,
+             json.dumps(parsed_output, default=_jsonable), error,
+             started_at if started_at is not None else time.time(), duration,
+             usage[0], usage[1], int(replayed)),
+        )
+
+    # -- lookups --------------------------------------------------------------
+
+    def find_response(self, stage: str, inputs_hash: str):
+        """Latest live recording of `stage` with these inputs, or None."""
+        return self.conn.execute(
+            "SELECT * FROM stages WHERE stage = ? AND inputs_hash = ? AND replayed = 0 "
+            "AND error IS NULL ORDER BY id DESC LIMIT 1",
+            (stage, inputs_hash),
+        ).fetchone()
+
+    def _next_replay_row(self, source_run: int, stage: str, inputs_hash: str):
+        """
+        Inside `replaying(run_id)`: the recorded rows of the source run are
+        consumed in order per stage. The inputs hash is checked but a mismatch
+        only warns, so prompt/parser changes can still be regression-tested.
+        """
+        consumed = self._replay_cursor.setdefault(stage, 0)
+        rows = self.conn.execute(
+            "SELECT * FROM stages WHERE run_id = ? AND stage = ? ORDER BY id",
+            (source_run, stage),
+        ).fetchall()
+        if consumed >= len(rows):
+            return None
+        self._replay_cursor[stage] = consumed + 1
+        row = rows[consumed]
+        if row["inputs_hash"] != inputs_hash:
+            print(f"[run_store] {stage}: inputs differ from run {source_run}, replaying anyway")
+        return row
+
+    @contextmanager
+    def replaying(self, run_id: int):
+        """Serve stages from recorded run `run_id` (in order) with no network calls."""
+        previous_mode, self.mode = self.mode, "replay"
+        self._replay_cursor = {}
+        token = _replay_source.set(run_id)
+        try:
+            yield
+        finally:
+            _replay_source.reset(token)
+            self.mode = previous_mode
+
+    def runs(self, form: str | None = None, since: float | None = None, limit: int = 20) -> list:
+        sql = ("SELECT r.*, COUNT(s.id) AS stages, SUM(s.duration) AS seconds, "
+               "SUM(s.input_tokens) AS input_tokens, SUM(s.output_tokens) AS output_tokens, "
+               "SUM(s.error IS NOT NULL) AS errors "
+               "FROM runs r LEFT JOIN stages s ON s.run_id = r.id WHERE 1 = 1")
+        params = []
+        if form:
+            sql += " AND r.form = ?"
+            params.append(form)
+        if since:
+            sql += " AND r.started_at >= ?"
+            params.append(since)
+        sql += " GROUP BY r.id ORDER BY r.started_at DESC LIMIT ?"
+        params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+
+    def get_run(self, run_id: int):
+        return self.conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+
+    def stages(self, run_id: int) -> list:
+        return self.conn.execute("SELECT * FROM stages WHERE run_id = ? ORDER BY id", (run_id,)).fetchall()
+
+    # -- the wrapper every model call goes through ----------------------------
+
+    def call(self, stage: str, form: str, inputs: dict, request, text=None, parse=None,
+             model: str | None = None, cacheable: bool = True) -> tuple:
+        """
+        Run one pipeline stage and return (raw_text, parsed).
+
+        request() performs the API call and returns the response object;
+        text(response) turns it into the raw text (default: the response itself);
+        parse(raw_text) turns the raw text into the stage's output.
+        In replay/cache mode the raw text comes from the store instead and only
+        parse() runs, so the local half of the stage is still exercised.
+        """
+        inputs = dict(inputs, model=model)
+        inputs_hash = hash_inputs(inputs)
+        started_at = time.time()
+        start = time.perf_counter()
+
+        raw, parsed, error, usage, replayed = None, None, None, (None, None), False
+        try:
+            if self.mode == "replay":
+                source_run = _replay_source.get()
+                row = (self._next_replay_row(source_run, stage, inputs_hash) if source_run is not None
+                       else self.find_response(stage, inputs_hash))
+                if row is None or row["raw_response"] is None:
+                    raise ReplayMiss(f"No recorded '{stage}' response for form {form!r} ({inputs_hash[:12]})")
+                raw, replayed = row["raw_response"], True
+            elif self.mode == "cache" and cacheable:
+                row = self.find_response(stage, inputs_hash)
+                if row is not None:
+                    raw, replayed = row["raw_response"], True
+
+            if raw is None:
+                response = request()
+                raw = text(response) if text else response
+                usage = usage_from_response(response)
+
+            parsed = parse(raw) if parse is not None else raw
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if self.mode != "off":
+                self.record_stage(stage, form, inputs, raw, parsed, model=model, error=error,
+                                  started_at=started_at, duration=time.perf_counter() - start,
+                                  usage=usage, replayed=replayed)
+        return raw, parsed
+
+
+def _jsonable(value):
+    """json.dumps fallback for pydantic models and other objects."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+@lru_cache(maxsize=None)
+def get_run_store() -> RunStore:
+    """Process-wide store configured from RUN_STORE_PATH / RUN_STORE_MODE."""
+    return RunStore(os.getenv("RUN_STORE_PATH", DEFAULT_STORE_PATH),
+                    os.getenv("RUN_STORE_MODE", "record"))
+
+
+# -----------------------------------------------------------------------------
+# Replay and legacy import
+# -----------------------------------------------------------------------------
+
+APP_EXTRACTORS = {
+    "contact": "extract_contact_info",
+    "job": "extract_job_info",
+    "course": "extract_course_proposal",
+}
+
+
+def _parsed(row):
+    return json.loads(row["parsed_output"]) if row["parsed_output"] else None
+
+
+def replay_run(store: RunStore, run_id: int) -> dict:
+    """
+    Re-run a recorded run with no network: recorded responses are fed back
+    into the same code path (UnifiedFormExtractor.run_pipeline, or the app.py
+    extractor) and the new parsed outputs are diffed against the recording.
+    """
+    run = store.get_run(run_id)
+    if run is None:
+        raise SystemExit(f"No run {run_id} in {store.path}")
+    recorded = store.stages(run_id)
+
+    start = time.perf_counter()
+    with store.replaying(run_id):
+        if run["kind"] == "pipeline":
+            from copy_structured import UnifiedFormExtractor
+
+            UnifiedFormExtractor(run["form"]).run_pipeline(fill=False)
+        elif run["kind"] == "app":
+            import app
+
+            extractor = getattr(app, APP_EXTRACTORS[run["form"]])
+            row = recorded[0]
+            # raise_errors: a ReplayMiss must abort the replay, not become an empty result
+            extractor(json.loads(row["inputs"])["text"], model=row["model"], raise_errors=True)
+        else:
+            raise SystemExit(f"Run {run_id} has kind {run['kind']!r}, which cannot be replayed")
+    elapsed = time.perf_counter() - start
+
+    replay = store.conn.execute(
+        "SELECT id FROM runs WHERE replay_of = ? ORDER BY id DESC LIMIT 1", (run_id,)
+    ).fetchone()
+    replayed = store.stages(replay["id"]) if replay else []
+
+    diffs = []
+    for old, new in zip(recorded, replayed):
+        if _parsed(old) != _parsed(new):
+            diffs.append({"stage": old["stage"], "recorded": _parsed(old), "replayed": _parsed(new)})
+    if len(replayed) != len(recorded):
+        diffs.append({"stage": "*", "recorded": f"{len(recorded)} stages", "replayed": f"{len(replayed)} stages"})
+
+    print(f"\n=== Replay of run {run_id} ({run['kind']}, {run['form']}) ===")
+    print(f"{'stage':<12}{'recorded s':>12}{'replayed s':>12}  tokens in/out")
+    for old, new in zip(recorded, replayed):
+        print(f"{old['stage']:<12}{old['duration']:>12.3f}{new['duration']:>12.3f}"
+              f"  {old['input_tokens']}/{old['output_tokens']}")
+    print(f"Total offline replay time: {elapsed:.3f}s")
+    print("Outputs match the recording." if not diffs else f"{len(diffs)} difference(s):")
+    for diff in diffs:
+        print(f"  [{diff['stage']}] recorded={diff['recorded']!r}\n  {'':>{len(diff['stage']) + 2}} replayed={diff['replayed']!r}")
+    return {"run_id": run_id, "replay_run_id": replay["id"] if replay else None,
+            "seconds": elapsed, "diffs": diffs}
+
+
+LEGACY_LOCS_WINDOW = 3600  # seconds between a locs.csv and the dump it belongs to
+
+
+def _legacy_form(raw: str, path: str) -> str:
+    """Form label for an old dump: the pydantic class Claude generated, else the file name."""
+    match = re.search(r"class\s+(\w+)\s*\(\s*BaseModel\s*\)", raw)
+    return match.group(1) if match else os.path.splitext(os.path.basename(path))[0]
+
+
+def import_legacy(store: RunStore, paths: list, locs_path: str | None = None,
+                  form: str | None = None) -> int:
+    """
+    Import form_analysis_raw_<timestamp>.txt dumps (plus the matching
+    form_model_<timestamp>.py* file next to each dump) and optionally a
+    recorded locs.csv.
+
+    The dumps don't record which screenshot they came from, so unless `form`
+    is given each run is filed under the class name in the dump (e.g.
+    "JobInfo"), and locs.csv under the form of the dump closest in time
+    (within LEGACY_LOCS_WINDOW), so both show up in `list --form`.
+    """
+    from copy_structured import extract_python_code
+
+    imported = 0
+    dump_forms = []  # (started_at, form)
+    for path in sorted(paths):
+        match = re.search(r"(\d{8}_\d{6})", os.path.basename(path))
+        started_at = (datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+                      if match else os.path.getmtime(path))
+        with open(path) as f:
+            raw = f.read()
+        dump_form = form or _legacy_form(raw, path)
+        dump_forms.append((started_at, dump_form))
+        code_paths = (glob.glob(os.path.join(os.path.dirname(path), f"form_model_{match.group(1)}.py*"))
+                      if match else [])
+        with store.run(form=dump_form, kind="legacy", started_at=started_at):
+            store.record_stage("model", dump_form, {"source": os.path.basename(path)}, raw,
+                               extract_python_code(raw), started_at=started_at)
+            for code_path in code_paths:
+                with open(code_path) as f:
+                    store.record_stage("model_file", dump_form, {"source": os.path.basename(code_path)},
+                                       f.read(), started_at=started_at)
+        imported += 1
+
+    if locs_path:
+        import csv
+
+        with open(locs_path) as f:
+            rows = list(csv.DictReader(f))
+        started_at = datetime.fromisoformat(rows[0]["Timestamp"].replace("Z", "+00:00")).timestamp() if rows else None
+        locs_form = form
+        if locs_form is None and started_at is not None and dump_forms:
+            distance, nearest = min((abs(when - started_at), name) for when, name in dump_forms)
+            if distance <= LEGACY_LOCS_WINDOW:
+                locs_form = nearest
+        locs_form = locs_form or os.path.splitext(os.path.basename(locs_path))[0]
+        with store.run(form=locs_form, kind="legacy", started_at=started_at):
+            store.record_stage("locate", locs_form, {"source": os.path.basename(locs_path)},
+                               json.dumps(rows), rows, started_at=started_at)
+        imported += 1
+    return imported
+
+
+def _parse_since(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect and replay recorded pipeline runs.")
+    parser.add_argument("--db", default=os.getenv("RUN_STORE_PATH", DEFAULT_STORE_PATH))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_cmd = commands.add_parser("list", help="recent runs, newest first")
+    list_cmd.add_argument("--form")
+    list_cmd.add_argument("--since", type=_parse_since, help="ISO date/time")
+    list_cmd.add_argument("--limit", type=int, default=20)
+
+    show = commands.add_parser("show", help="stages of one run")
+    show.add_argument("run_id", type=int)
+
+    replay = commands.add_parser("replay", help="re-run a recorded run offline and diff the outputs")
+    replay.add_argument("run_id", type=int)
+
+    legacy = commands.add_parser("import-legacy", help="import form_analysis_raw_*.txt dumps")
+    legacy.add_argument("paths", nargs="*", default=glob.glob("form_analysis_raw_*.txt"))
+    legacy.add_argument("--locs", help="a recorded locs.csv to import too")
+    legacy.add_argument("--form", help="file everything under this form (e.g. the screenshot path)")
+
+    args = parser.parse_args(argv)
+    # Share the process-wide store with copy_structured.py / app.py so replays land in it
+    os.environ["RUN_STORE_PATH"] = args.db
+    store = get_run_store()
+    store.mode = "record"
+
+    if args.command == "list":
+        print(f"{'id':>5}  {'started':<19}  {'kind':<9}{'stages':>7}{'errors':>7}{'seconds':>9}"
+              f"{'tokens in/out':>16}  form")
+        for run in store.runs(args.form, args.since, args.limit):
+            started = datetime.fromtimestamp(run["started_at"]).strftime("%Y-%m-%d %H:%M:%S")
+            tokens = f"{run['input_tokens'] or '-'}/{run['output_tokens'] or '-'}"
+            print(f"{run['id']:>5}  {started:<19}  {run['kind']:<9}{run['stages']:>7}{run['errors'] or 0:>7}"
+                  f"{run['seconds'] or 0:>9.2f}{tokens:>16}  {run['form']}")
+    elif args.command == "show":
+        for stage in store.stages(args.run_id):
+            print(f"--- {stage['stage']} ({stage['model']}) {stage['duration']:.2f}s "
+                  f"tokens {stage['input_tokens']}/{stage['output_tokens']}"
+                  + (" [replayed]" if stage["replayed"] else "")
+                  + (f" ERROR {stage['error']}" if stage["error"] else ""))
+            print(stage["parsed_output"])
+    elif args.command == "replay":
+        try:
+            result = replay_run(store, args.run_id)
+        except ReplayMiss as e:
+            print(f"Replay of run {args.run_id} failed: {e}")
+            return 1
+        return 1 if result["diffs"] else 0
+    elif args.command == "import-legacy":
+        print(f"Imported {import_legacy(store, args.paths, args.locs, args.form)} legacy record(s) into {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    # Run as a script this module is __main__, while copy_structured.py / app.py
+    # import `run_store` as a second copy with its own store and context vars,
+    # so replaying() here would not reach them. Dispatch through the real module.
+    import run_store
+
+    sys.exit(run_store.main())
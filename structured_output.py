@@ -0,0 +1,505 @@
+"""
+Schema-constrained structured output for every model call in the pipeline.
+
+One layer, three pieces:
+  1) Provider-native schemas derived from pydantic models
+       - openai_response_format(Model)  -> response_format={"type": "json_schema", ...}
+         (strict mode: every property required, no additionalProperties)
+       - gemini_config(schema)          -> response_mime_type + response_schema
+     plus typed models for Gemini's location answers (FormLocation, TableItem).
+  2) IncrementalJSONParser(schema): a single-pass parser fed with streamed
+     chunks. It checks the JSON structure as bytes arrive, validates each
+     element of a top-level array as soon as it closes (list[Model]) or the
+     whole object the moment it closes (Model), and reports `done` then, so
+     callers stop the stream instead of paying for trailing prose. If the
+     structure breaks, the rest of the reply is still read (up to
+     REPAIR_READ_LIMIT) so the repair step sees the whole text.
+  3) parse_structured(raw, schema, parser): a clean streamed reply is returned
+     straight from what the parser already validated; otherwise run a
+     targeted repair (strip fences/prose, drop a truncated last member, drop
+     trailing commas, fix single quotes, drop invalid list items, coerce/null
+     bad fields) instead of re-running the whole request.
+"""
+
+import ast
+import json
+import re
+from types import SimpleNamespace
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, create_model
+
+
+class StructuredOutputError(ValueError):
+    """The reply could not be parsed or repaired into the schema (`raw` holds the reply)."""
+
+    def __init__(self, message: str, raw: str | None = None):
+        super().__init__(message)
+        self.raw = raw
+
+
+# -----------------------------------------------------------------------------
+# 1) Schemas
+# -----------------------------------------------------------------------------
+
+class FormLocation(BaseModel):
+    """One item of Gemini's `[{'point': [y, x], 'label': '...'}, ...]` answer."""
+    point: list[int] = Field(min_length=2, max_length=2, description="[y, x], normalized to 0-1000")
+    label: str
+
+
+class TableItem(BaseModel):
+    """One item of the table-geometry answer: a box (first_cell) or a point (rows_input)."""
+    label: str
+    box_2d: list[int] | None = Field(default=None, description="[ymin, xmin, ymax, xmax], 0-1000")
+    point: list[int] | None = Field(default=None, description="[y, x], 0-1000")
+
+
+class AnyObject(BaseModel):
+    """Any JSON object; used when a caller has no schema (OpenAI json_object mode)."""
+    model_config = ConfigDict(extra="allow")
+
+
+def fields_model(fields: list, name: str = "ExtractedFields") -> type[BaseModel]:
+    """A model with one optional string per field name (for ad-hoc key lists)."""
+    return create_model(name, **{field: (str | None, None) for field in fields})
+
+
+def _strict(schema: dict) -> dict:
+    """OpenAI strict mode: all properties required, no extra keys, no defaults."""
+    if isinstance(schema, dict):
+        schema = {key: _strict(value) for key, value in schema.items() if key != "default"}
+        if schema.get("type") == "object" and "properties" in schema:
+            schema["required"] = list(schema["properties"])
+            schema["additionalProperties"] = False
+    elif isinstance(schema, list):
+        schema = [_strict(value) for value in schema]
+    return schema
+
+
+def openai_response_format(model: type[BaseModel]) -> dict:
+    """response_format for chat.completions with a strict JSON schema from `model`."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "schema": _strict(model.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+def gemini_config(schema) -> dict:
+    """generate_content config forcing JSON that matches `schema` (a model or list[Model])."""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+# -----------------------------------------------------------------------------
+# 2) Incremental validating parser
+# -----------------------------------------------------------------------------
+
+REPAIR_READ_LIMIT = 64_000  # chars of a broken reply kept for the repair step
+_BARE_CHARS = set(" \t\r\n,:-+.0123456789eEtruefalsn")
+
+
+def _item_model(schema):
+    """Model from list[Model], else None."""
+    if getattr(schema, "__origin__", None) is list:
+        return schema.__args__[0]
+    return None
+
+
+class IncrementalJSONParser:
+    """
+    Feed streamed text with `feed(chunk)`. Leading prose / code fences before
+    the first `{` or `[` are skipped. Raises StructuredOutputError as soon as
+    the structure is invalid (bad character, mismatched bracket).
+    With `schema=list[Model]` and a top-level array, every element is
+    validated the moment it closes; valid ones are returned from feed() and
+    kept in `items`, invalid ones collected in `invalid_items`.
+    With `schema=Model` and a top-level object, the object is validated once
+    when it closes: `result` holds the model, or `error` the ValidationError.
+    """
+
+    def __init__(self, schema=None):
+        self.schema = schema
+        self.item_model = _item_model(schema)
+        self.raw = ""          # everything received
+        self.start = None      # index of the first bracket in raw
+        self.end = None        # index just past the closing bracket
+        self.stack = []
+        self.in_string = False
+        self.string_start = None
+        self.escape = False
+        self.element_start = None
+        self.items = []
+        self.invalid_items = []
+        self.result = None
+        self.error = None
+
+    @property
+    def done(self) -> bool:
+        return self.end is not None
+
+    @property
+    def json_text(self) -> str:
+        if self.start is None:
+            return ""
+        return self.raw[self.start:self.end]
+
+    def feed(self, chunk: str) -> list:
+        if self.done:
+            return []
+        offset = len(self.raw)
+        self.raw += chunk
+        completed = []
+        for i, char in enumerate(chunk, start=offset):
+            if self.start is None:
+                if char in "{[":
+                    self.start = i
+                    self.stack.append(char)
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char in "{[":
+                if len(self.stack) == 1 and self.stack[0] == "[":
+                    self.element_start = i
+                self.stack.append(char)
+            elif char in "}]":
+                opener = self.stack.pop() if self.stack else None
+                if opener != {"}": "{", "]": "["}[char]:
+                    raise StructuredOutputError(f"Mismatched '{char}' at offset {i - self.start}")
+                if len(self.stack) == 1 and self.element_start is not None:
+                    item = self._validate_item(self.raw[self.element_start:i + 1])
+                    if item is not None:
+                        # kept right away, so items survive a later structural error
+                        self.items.append(item)
+                        completed.append(item)
+                    self.element_start = None
+                if not self.stack:
+                    self.end = i + 1
+                    self._validate_result()
+                    break
+            elif char not in _BARE_CHARS:
+                raise StructuredOutputError(f"Unexpected {char!r} at offset {i - self.start}")
+        return completed
+
+    def _validate_item(self, text: str):
+        if self.item_model is None:
+            return None
+        try:
+            return self.item_model.model_validate_json(text)
+        except ValidationError as e:
+            if any(problem["type"] == "json_invalid" for problem in e.errors()):
+                # Bad JSON syntax (trailing comma, single quotes), not bad data: repair it
+                try:
+                    return self.item_model.model_validate(_loads_lenient(text))
+                except (StructuredOutputError, ValidationError):
+                    pass
+            self.invalid_items.append((text, e))
+            return None
+
+    def _validate_result(self):
+        if self.item_model is not None or self.schema is None or self.raw[self.start] != "{":
+            return
+        try:
+            self.result = self.schema.model_validate_json(self.json_text)
+        except ValidationError as e:
+            self.error = e
+
+    def close_truncated(self, drop_partial: bool = True) -> str:
+        """
+        The JSON text so far with open brackets closed. A value still being
+        written when the reply was cut off is dropped, never kept as data:
+        an open string always, a trailing number/literal if `drop_partial`.
+        """
+        text = self.json_text
+        if self.done or not text:
+            return text
+        if self.in_string:
+            text = self.raw[self.start:self.string_start]
+        elif drop_partial:
+            text = re.sub(r"[-+.\w]+$", "", text)
+        text = re.sub(r"[\s,:]+$", "", text)
+        closers = {"{": "}", "[": "]"}
+        return text + "".join(closers[opener] for opener in reversed(self.stack))
+
+
+def consume_stream(chunks, parser: IncrementalJSONParser) -> str:
+    """
+    Feed text chunks until the top-level value closes; stopping there is what
+    saves the tokens. If the structure breaks first, the rest of the reply
+    (up to REPAIR_READ_LIMIT chars) is only collected, so the repair step gets
+    the whole text rather than a cut-off prefix. Returns the raw text received.
+    """
+    broken = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if broken:
+            parser.raw += chunk
+            if len(parser.raw) >= REPAIR_READ_LIMIT:
+                print(f"[structured] Reply over {REPAIR_READ_LIMIT} chars, stopping the stream")
+                break
+            continue
+        try:
+            parser.feed(chunk)
+        except StructuredOutputError as e:
+            print(f"[structured] {e}; reading the rest of the reply for repair")
+            broken = True
+            continue
+        if parser.done:
+            break
+    return parser.raw
+
+
+def stream_openai(client, parser: IncrementalJSONParser, **kwargs):
+    """
+    chat.completions.create(stream=True) through the incremental parser.
+    Returns an object with `.text` and `.usage`, so the run store records
+    token counts the same way as for a non-streamed response.
+    """
+    stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    events = iter(stream)
+    usage = None
+
+    def chunks():
+        nonlocal usage
+        for event in events:
+            if event.usage is not None:
+                usage = event.usage
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+    text = consume_stream(chunks(), parser)
+    if parser.done and usage is None:
+        # A schema-constrained reply ends at the closing brace, so the usage
+        # event is only a few events away; anything longer is cut off
+        for event, _ in zip(events, range(4)):
+            if event.usage is not None:
+                usage = event.usage
+                break
+    stream.close()
+    return SimpleNamespace(text=text, usage=usage)
+
+
+def stream_gemini(client, parser: IncrementalJSONParser, **kwargs):
+    """generate_content_stream through the incremental parser (same return shape as stream_openai)."""
+    usage_metadata = None
+
+    def chunks():
+        nonlocal usage_metadata
+        for chunk in client.models.generate_content_stream(**kwargs):
+            usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+            yield chunk.text or ""
+
+    text = consume_stream(chunks(), parser)
+    return SimpleNamespace(text=text, usage_metadata=usage_metadata)
+
+
+# -----------------------------------------------------------------------------
+# 3) Validation with targeted repair
+# -----------------------------------------------------------------------------
+
+_QUOTED = r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\''
+_PY_LITERALS = {"null": "None", "true": "True", "false": "False"}
+
+
+def _sub_outside_strings(pattern: str, repl, text: str) -> str:
+    """re.sub with a function `repl` that leaves quoted spans ("..." and '...') untouched."""
+    regex = re.compile(f"(?P<quoted>{_QUOTED})|{pattern}")
+    return regex.sub(lambda m: m.group("quoted") if m.group("quoted") is not None else repl(m), text)
+
+
+def _loads_lenient(text: str):
+    """json.loads, then the cheap textual repairs, one at a time."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    without_trailing_commas = _sub_outside_strings(r",\s*(?P<close>[}\]])",
+                                                   lambda m: m.group("close"), text)
+    try:
+        return json.loads(without_trailing_commas)
+    except json.JSONDecodeError:
+        pass
+
+    # Python-style literals: single quotes, None/True/False (the old Gemini prompt's example)
+    pythonish = _sub_outside_strings(r"\b(?:null|true|false)\b",
+                                     lambda m: _PY_LITERALS[m.group(0)], without_trailing_commas)
+    try:
+        return ast.literal_eval(pythonish)
+    except (ValueError, SyntaxError) as e:
+        raise StructuredOutputError(f"Could not repair JSON: {e}") from None
+
+
+def _extract_json(raw: str) -> str:
+    """Cut code fences / prose around the JSON value; close it if it was truncated."""
+    parser = IncrementalJSONParser()
+    try:
+        parser.feed(raw)
+    except StructuredOutputError:
+        # Not strict JSON (e.g. single quotes): fall back to the widest bracketed
+        # span and let _loads_lenient deal with it
+        first = min((i for i in (raw.find("{"), raw.find("[")) if i != -1), default=-1)
+        last = max(raw.rfind("}"), raw.rfind("]"))
+        if first == -1 or last < first:
+            raise StructuredOutputError("No JSON value in the reply") from None
+        return raw[first:last + 1]
+    if parser.start is None:
+        raise StructuredOutputError("No JSON value in the reply")
+    if parser.done:
+        return parser.json_text
+    return _close_truncated(parser.json_text)
+
+
+def _close_truncated(text: str) -> str:
+    """
+    A reply cut off mid-value: drop the value being written, close the
+    brackets, and if the last member is still incomplete (e.g. a key with no
+    value yet) drop it too, back to the previous comma.
+    """
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    closed = parser.close_truncated()
+    while True:
+        try:
+            json.loads(closed)
+            return closed
+        except json.JSONDecodeError:
+            cut = closed.rfind(",")
+            if cut <= 0:
+                # no complete member at all: keep just the outer brackets
+                cut = 1
+            # everything before a comma outside a string was complete
+            parser = IncrementalJSONParser()
+            parser.feed(closed[:cut])
+            closed = parser.close_truncated(drop_partial=False)
+
+
+def _repair_fields(data: dict, model: type[BaseModel], error: ValidationError) -> dict:
+    """Fix only the fields that failed: numbers -> str where a string is expected, else default."""
+    data = dict(data)
+    for problem in error.errors():
+        if not problem["loc"]:
+            continue
+        field = problem["loc"][0]
+        info = model.model_fields.get(field)
+        if info is None:
+            data.pop(field, None)
+            continue
+        value = data.get(field)
+        if problem["type"] == "string_type" and isinstance(value, (int, float)) and not isinstance(value, bool):
+            data[field] = str(value)
+        elif not info.is_required():
+            data[field] = info.get_default()
+        else:
+            raise StructuredOutputError(f"Required field '{field}' is invalid: {problem['msg']}")
+    return data
+
+
+def _fed_parser(raw: str, schema, parser: IncrementalJSONParser | None) -> IncrementalJSONParser:
+    """
+    `parser` if the reply was streamed through it (it saw exactly `raw`),
+    otherwise `raw` fed through a fresh one, still a single pass. Either may
+    have stopped at a structural error; the items validated before it are kept.
+    """
+    if parser is not None and parser.schema is schema and parser.raw.strip() == raw.strip():
+        return parser
+    parser = IncrementalJSONParser(schema)
+    try:
+        parser.feed(raw)
+    except StructuredOutputError:
+        pass
+    return parser
+
+
+def _streamed_result(parser: IncrementalJSONParser):
+    """What the incremental parser already validated, or None if the repair path is needed."""
+    if not parser.done:
+        return None
+
+    item_model = parser.item_model
+    if item_model is not None and parser.raw[parser.start] == "[":
+        if parser.invalid_items:
+            print(f"[structured] Dropped {len(parser.invalid_items)} invalid {item_model.__name__} item(s)")
+            if not parser.items:
+                raise StructuredOutputError(f"No valid {item_model.__name__} items in the reply")
+        return parser.items
+    return parser.result
+
+
+def parse_structured(raw: str, schema, parser: IncrementalJSONParser | None = None):
+    """
+    Validate `raw` against `schema` (a pydantic model class or list[Model]).
+    A complete reply that validates is taken from `parser` (see _fed_parser).
+    Anything else is repaired locally instead of asking for the reply again:
+      - JSON: fences/prose stripped, truncated last member dropped, trailing commas, quotes
+      - list[Model]: invalid items are dropped, valid ones kept; if the whole
+        reply can't be repaired, the items validated while streaming are returned
+      - Model: failing optional fields are coerced or reset to their default
+    Raises StructuredOutputError (with the reply in `.raw`) if nothing usable is left.
+    """
+    parser = _fed_parser(raw, schema, parser)
+    try:
+        result = _streamed_result(parser)
+        if result is not None:
+            return result
+        return _repair(raw, schema)
+    except StructuredOutputError as e:
+        if parser.items:
+            print(f"[structured] Repair failed ({e}); keeping {len(parser.items)} item(s) validated while streaming")
+            return parser.items
+        raise StructuredOutputError(str(e), raw=raw) from None
+
+
+def _repair(raw: str, schema):
+    """The repair path of parse_structured: lenient JSON, then per-item / per-field fixes."""
+    data = _loads_lenient(_extract_json(raw))
+
+    item_model = _item_model(schema)
+    if item_model is not None:
+        if isinstance(data, dict):
+            data = [data]
+        items, dropped = [], 0
+        for entry in data:
+            try:
+                items.append(item_model.model_validate(entry))
+            except ValidationError:
+                dropped += 1
+        if dropped:
+            print(f"[structured] Dropped {dropped} invalid {item_model.__name__} item(s)")
+        if data and not items:
+            raise StructuredOutputError(f"No valid {item_model.__name__} items in the reply")
+        return items
+
+    if not isinstance(data, dict):
+        raise StructuredOutputError(f"Expected a JSON object for {schema.__name__}")
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        repaired = _repair_fields(data, schema, e)
+        print(f"[structured] Repaired {len(e.errors())} field(s) of {schema.__name__}")
+        return schema.model_validate(repaired)
+
+
+def dump(value):
+    """Plain JSON-able data from a model or a list of models."""
+    if isinstance(value, list):
+        return [dump(item) for item in value]
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    return value
+
+
+LOCATIONS_SCHEMA = list[FormLocation]
+TABLE_SCHEMA = list[TableItem]